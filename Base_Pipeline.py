@@ -0,0 +1,78 @@
+from __future__ import annotations
+from functools import lru_cache, partial
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from Join_Union import CT_RIGHT_COLS_DEFAULT, join_tt_ct_on_nct, build_base_left, left_selection, save_sanitized
+from Lead_Sponsor import add_lead_sponsor
+from Revenue_Mapping import map_revenue
+from Utils import save_df
+from Output_Writer import run_concurrently, excel_fixes, seed_excel_fixes, take_fixes
+
+
+def build_base(
+    tt_df: pd.DataFrame,
+    ct_df: pd.DataFrame,
+    *,
+    revenue: dict,
+    right_cols_to_keep: Iterable[str] | None = None,
+    suffix_for_ct: str = "_CT") -> dict[str, pd.DataFrame]:
+    """
+    Everything the /run checkboxes don't change, computed once per data snapshot:
+      join (J), the tagged + base-filtered Left branch with Bain_StudyType, and the full union of both with
+      Bain_Lead Sponsor and the revenue columns (`revenue` = map_revenue keyword arguments, without output_path).
+    Lead sponsor and revenue mapping work row by row, so selecting rows afterwards equals running them on the selection.
+    """
+    if right_cols_to_keep is None:
+        right_cols_to_keep = CT_RIGHT_COLS_DEFAULT
+    join_df, left_only_df = join_tt_ct_on_nct(tt_df, ct_df, right_cols_to_keep=right_cols_to_keep, suffix_for_ct=suffix_for_ct)
+    base_left = build_base_left(left_only_df)
+    union = pd.concat([base_left, join_df], axis=0, ignore_index=True, sort=False)
+    rev = map_revenue(add_lead_sponsor(union), **revenue)
+    print(f"[Base_Pipeline] base built: {len(base_left):,} left rows, {len(join_df):,} join rows, {len(rev.columns)} columns")
+    return {"left": base_left, "join": join_df, "rev": rev}
+
+
+def refine(
+    base: dict[str, pd.DataFrame],
+    *,
+    study_interventional: bool | None = None,
+    study_observational: bool | None = None,
+    sponsor_industry: bool | None = None,
+    sponsor_academic: bool | None = None,
+    sponsor_others: bool | None = None) -> dict[str, pd.DataFrame]:
+    # Per-request stage: one row mask over the base (the join is never filtered), then column selection
+    left_mask = left_selection(base["left"], study_interventional, study_observational,
+                               sponsor_industry=sponsor_industry, sponsor_academic=sponsor_academic, sponsor_others=sponsor_others)
+    rows = np.concatenate([np.flatnonzero(left_mask), len(left_mask) + np.arange(len(base["join"]))])
+
+    rev_cols = list(base["rev"].columns)
+    union_cols = rev_cols[: rev_cols.index("Bain_Lead Sponsor")]
+    drop = [] if (study_interventional or study_observational) else ["Bain_StudyType"]   # only present when Stage 2 ran
+
+    rev = base["rev"].iloc[rows].drop(columns=drop).reset_index(drop=True)
+    lead_cols = [c for c in union_cols if c not in drop] + ["Bain_Lead Sponsor"]
+    out = {
+        "left": base["left"].loc[left_mask].drop(columns=drop),
+        "join": base["join"],
+        "union": rev[lead_cols[:-1]],
+        "lead": rev[lead_cols],
+        "rev": rev}
+
+    # Excel fixes: the base union is scanned once per snapshot, every output takes its rows' fixes from it
+    # (lazy: nothing is scanned unless a sanitized output is written)
+    rev_fixes = lru_cache(maxsize=1)(lambda: take_fixes(excel_fixes(base["rev"]), rows))
+    for name in ("union", "lead", "rev"):
+        seed_excel_fixes(out[name], lambda cols=set(out[name].columns): {c: f for c, f in rev_fixes().items() if c in cols})
+    seed_excel_fixes(out["left"], lambda: take_fixes(excel_fixes(base["rev"]), np.flatnonzero(left_mask), out["left"].columns))
+    seed_excel_fixes(base["join"], lambda: take_fixes(excel_fixes(base["rev"]), len(left_mask) + np.arange(len(base["join"])),
+                                                      base["join"].columns))
+    return out
+
+
+def save_outputs(frames: dict[str, pd.DataFrame], paths: dict[str, str | None], workers: int = 4) -> None:
+    # left/join/union go through the Excel sanitizer (CSV fallback) like run_join_operation; lead/rev are saved as-is.
+    # Independent files, so they are written concurrently.
+    tasks = [partial(save_sanitized, frames[name], paths[name]) for name in ("join", "union", "left") if paths.get(name)]
+    tasks += [partial(save_df, frames[name], paths[name], index=False) for name in ("lead", "rev") if paths.get(name)]
+    run_concurrently(tasks, workers=workers)
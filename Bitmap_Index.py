@@ -0,0 +1,178 @@
+from __future__ import annotations
+from typing import Callable, Iterable
+import numpy as np
+import pandas as pd
+from Utils import frame_memo
+from filtering import PHASE_MAP, REGION_RULES, TA_MAP, TA_VACCINE_VARIANTS, therapeutic_area, trial_region, date_index, month_window
+from Join_Union import STUDY_TEXT_COLS, study_type, sponsor_type_tags
+
+MISSING = "(blank)"   # label of rows without a value in a dimension
+_POPCOUNT = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)   # set bits per byte (np.bitwise_count is NumPy 2 only)
+
+# Filter dimensions of the filters page, as labels per row of the union snapshot (Base_Pipeline.build_base "rev")
+def _labels(col: str) -> Callable[[pd.DataFrame], pd.Series]:
+    return lambda df: df[col] if col in df.columns else pd.Series(MISSING, index=df.index)
+
+def _left_or_derived(col: str, needs: list[str], derive: Callable[[pd.DataFrame], Iterable]) -> Callable[[pd.DataFrame], pd.Series]:
+    # `col` exists for the Left-branch rows only; the other (join) rows get the same rule applied to their TT columns
+    # (they stay MISSING if the frame lacks those columns)
+    def labels(df: pd.DataFrame) -> pd.Series:
+        out = (df[col] if col in df.columns else pd.Series(pd.NA, index=df.index)).astype(object)
+        todo = np.flatnonzero(out.isna().to_numpy())
+        if len(todo) and all(c in df.columns for c in needs):
+            out = out.copy()
+            out.iloc[todo] = np.asarray(derive(df[needs].iloc[todo]), dtype=object)
+        return out
+    return labels
+
+def _phase(df: pd.DataFrame) -> pd.Series:
+    # raw phase as offered on the filters page ("I/II", ...), anything else is "Others"
+    phase = df["Trial Phase"].astype(object).fillna("").astype(str).str.upper().str.strip()
+    return phase.where(phase.isin(PHASE_MAP.keys()), "Others")
+
+DIMENSIONS: dict[str, Callable[[pd.DataFrame], Iterable]] = {
+    "phase": _phase,
+    "study_design": _left_or_derived("Bain_StudyType", STUDY_TEXT_COLS, study_type),
+    "trial_status": _labels("TT_Trial Status"),
+    "lead_sponsor_type": _left_or_derived("Bain_Cleaned Sponsor/Collaborator Type_tagged", ["Sponsor/Collaborator Type"],
+                                          lambda df: sponsor_type_tags(df["Sponsor/Collaborator Type"])[1]),
+    "therapeutic_area": therapeutic_area,
+    "major_sponsor": _labels("Bain_Lead Sponsor"),
+    "region": trial_region,
+    "us_segment": _labels("US company segmentation"),
+    "ww_segment": _labels("WW company segmentation"),
+}
+
+# every label the rules above can produce for the closed dimensions (valid filter values even without rows)
+RULE_LABELS: dict[str, list[str]] = {
+    "phase": [*PHASE_MAP, "Others"],
+    "study_design": ["Interventional", "Observational", "Ambiguous", "Unknown"],
+    "lead_sponsor_type": ["Industry", "Academic", "Others"],
+    "therapeutic_area": [*dict.fromkeys(TA_MAP.values()), "Multiple"],
+    "region": [label for _, label in REGION_RULES] + ["Other"],
+}
+
+# filters page option values (app.filters) that differ from the labels above
+PAGE_LABELS: dict[str, dict[str, str]] = {
+    "lead_sponsor_type": {"Other": "Others"},
+    "therapeutic_area": {"CNS": "Cns", **{ta: "Vaccines" for ta in TA_VACCINE_VARIANTS}},
+    "region": {"na": "NA only", "eu": "EU only", "apac": "APAC only", "euapac": "EU and APAC", "naapac": "NA and APAC"},
+}
+
+
+def filter_values(dim: str, values, known: Iterable[str]) -> list[str]:
+    # one value or a list of them -> labels (page option values mapped); KeyError for values `known` doesn't have
+    if isinstance(values, (str, int)) and not isinstance(values, bool):
+        values = [values]
+    if not isinstance(values, (list, tuple)) or not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in values):
+        raise ValueError(f"{dim}: expected a value or a list of values, got {values!r}")
+    labels = [PAGE_LABELS.get(dim, {}).get(str(v), str(v)) for v in values]
+    known = set(known) | set(RULE_LABELS.get(dim, ()))
+    unknown = [v for v in labels if v not in known]
+    if unknown:
+        raise KeyError(f"Unknown {dim} value(s): {', '.join(map(repr, unknown))} (known: {', '.join(sorted(known))})")
+    return labels
+
+
+def dimension_labels(df: pd.DataFrame, name: str, dimensions: dict[str, Callable[[pd.DataFrame], Iterable]] = DIMENSIONS) -> pd.Series:
+    # one label per row (object, MISSING for nulls/blanks)
+    labels = pd.Series(np.asarray(dimensions[name](df), dtype=object))
+    return labels.where(labels.notna() & labels.ne(""), MISSING)
+
+
+class BitmapIndex:
+    """
+    One bitmap per (dimension, value) over the rows of a frame, so a filter combination is a few bitwise
+    AND/ORs and a count is a popcount, without touching the frame's strings.
+      - bitmaps are packed (np.packbits, 1 bit per row); values held by fewer than 1/32 of the rows keep their
+        sorted row positions instead (smaller than a bitmap, like roaring's array containers)
+      - select({dim: [values]}): OR within a dimension, AND across dimensions; an empty or missing list keeps every row.
+        A single value counts as a one-item list, and the filters page's option values are accepted (PAGE_LABELS)
+    """
+
+    def __init__(self, df: pd.DataFrame, dimensions: dict[str, Callable[[pd.DataFrame], Iterable]] = DIMENSIONS):
+        self.n = len(df)
+        self._dates = date_index(df)   # arrays only: the index must not keep the frame alive (see frame_memo)
+        self.all = np.packbits(np.ones(self.n, dtype=bool))
+        self._dims: dict[str, dict[str, tuple[str, np.ndarray]]] = {}
+        self._sparse: dict[str, tuple[list[str], np.ndarray, np.ndarray]] = {}   # dim -> (values, positions, value codes)
+        for name in dimensions:
+            codes, uniques = pd.factorize(dimension_labels(df, name, dimensions))
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+            bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+            entries, sparse = {}, []
+            for value, pos in zip(uniques, np.split(order, bounds)):
+                entries[str(value)] = ("bits", self._pack(pos)) if len(pos) * 32 > self.n else ("pos", pos)
+                if entries[str(value)][0] == "pos":
+                    sparse.append((str(value), pos))
+            self._dims[name] = entries
+            if sparse:
+                self._sparse[name] = ([v for v, _ in sparse], np.concatenate([p for _, p in sparse]),
+                                      np.repeat(np.arange(len(sparse)), [len(p) for _, p in sparse]))
+        print(f"[Bitmap_Index] {self.n:,} rows, {sum(map(len, self._dims.values())):,} values over {len(self._dims)} dimensions, "
+              f"{self.nbytes / 2**20:,.1f} MiB")
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for entries in self._dims.values() for _, a in entries.values())
+
+    def _pack(self, pos: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.n, dtype=bool)
+        mask[pos] = True
+        return np.packbits(mask)
+
+    def dimensions(self) -> dict[str, list[str]]:
+        return {name: sorted(entries) for name, entries in self._dims.items()}
+
+    def bits(self, dim: str, value: str) -> np.ndarray:
+        kind, data = self._dims[dim].get(value, ("pos", np.empty(0, dtype=np.int32)))
+        return data if kind == "bits" else self._pack(data)
+
+    def select(self, filters: dict[str, Iterable[str]] | None = None, *, start: tuple[int, int] | None = None,
+               end: tuple[int, int] | None = None) -> np.ndarray:
+        # packed selection; start/end (year, month) restrict Start Date to [start, end) like apply_filters.
+        # ValueError for malformed filters, KeyError for unknown dimensions/values (see filter_values)
+        if not isinstance(filters, (dict, type(None))):
+            raise ValueError(f"filters must map dimensions to values, got {filters!r}")
+        sel = self.all.copy()
+        for dim, values in (filters or {}).items():
+            if dim not in self._dims:
+                raise KeyError(f"Unknown filter dimension: {dim!r} (known: {', '.join(self._dims)})")
+            values = filter_values(dim, values, self._dims[dim])
+            if values:
+                any_of = np.zeros_like(sel)
+                for v in values:
+                    any_of |= self.bits(dim, v)
+                sel &= any_of
+        if start is not None or end is not None:
+            (y0, m0), (y1, m1) = start or (1, 1), end or (9999, 12)
+            sel &= self._pack(month_window(self._dates, y0, m0, y1, m1))
+        return sel
+
+    @staticmethod
+    def count(bits: np.ndarray) -> int:
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+    def rows(self, bits: np.ndarray) -> np.ndarray:
+        # row positions (ascending) of a selection
+        return np.flatnonzero(np.unpackbits(bits, count=self.n))
+
+    def facets(self, bits: np.ndarray, dims: Iterable[str] | None = None) -> dict[str, dict[str, int]]:
+        # per dimension, how many selected rows hold each value (values without selected rows are left out)
+        out = {}
+        for dim in (self._dims if dims is None else dims):
+            counts = {value: BitmapIndex.count(bits & data)
+                      for value, (kind, data) in self._dims[dim].items() if kind == "bits"}
+            if dim in self._sparse:
+                # all position-list values at once: test each position's bit, then count per value
+                values, pos, codes = self._sparse[dim]
+                hit = (bits[pos >> 3] >> (7 - (pos & 7)).astype(np.uint8)) & 1
+                counts.update(zip(values, np.bincount(codes, weights=hit, minlength=len(values)).astype(int).tolist()))
+            counts = {v: c for v, c in counts.items() if c}
+            out[dim] = dict(sorted(counts.items(), key=lambda kv: -kv[1]))
+        return out
+
+
+def bitmap_index(df: pd.DataFrame) -> BitmapIndex:
+    # one index per union snapshot (frame_memo: rebuilt only when the frame is)
+    return frame_memo(df, "bitmap_index", BitmapIndex)
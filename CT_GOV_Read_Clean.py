@@ -1,29 +1,109 @@
 from __future__ import annotations
 import re
+import sys
+from pathlib import Path
+from typing import Iterable
 import pandas as pd
-from Utils import clean_selected_columns, to_datetime_cols, remove_punctuation_inplace, save_df
+import Utils
+from Utils import (clean_selected_columns, clean_text_series, to_datetime_cols, remove_punctuation_inplace, save_df,
+    text_cleaning_pool, print_clean_timings, apply_schema, memory_report)
+from Snapshot_Cache import settings_fingerprint
+from Delta_Ingest import incremental_clean
 
+# Raw CT.gov header -> pipeline name
+CT_RENAMES = {'NCT id': 'NCT ID', 'sex': 'Patient Gender'}
+CT_FILTER_COL = 'interventions'
+# Known free-text columns (raw names): parsed straight to string, skipping type inference
+CT_TEXT_DTYPES = {c: "string" for c in ['NCT id', 'study title', 'study status', 'interventions', 'condition', 'sex']}
+# Low-cardinality columns stored as categoricals once cleaned (pipeline names)
+CT_CATEGORY_COLS = ['study status', 'Patient Gender']
+# Other text columns become string[pyarrow] once cleaned; False keeps the cleaning dtypes
+COMPACT_DTYPES = True
+PRINT_MEMORY_REPORT = True
 
-def CT_GOV_Cleaning(csv_path: str, output_path: str | None = None) -> pd.DataFrame:
 
-    # 1) DATA CLEANING
-    DATE_COLS = ["start_date", "primary_completion_date", "completion_date"]
-    CSV_DO_CLEAN = True                  # set to False later to skip cleaning entirely
-    CSV_STRIP_WS = True                  # Leading/Trailing whitespace
-    CSV_COLLAPSE_WS = False              # tabs/line-breaks/dup spaces
-    CSV_CASE_MODE = "upper"              # "none"|"upper"|"lower"|"title"
-    CSV_REPLACE_NULLS_STRINGS = True
-    CSV_REPLACE_NULLS_NUMBERS = True
-    CSV_DROP_ROWS = True                 # drop rows all-empty across the cleaned scope (all cols here)
-    CSV_DROP_COLS = True                 # drop columns that are entirely null after cleaning
-    CSV_REMOVE_PUNCTUATION = True        # optional extra to mirror Alteryx "Punctuation"
+# 1) DATA CLEANING
+DATE_COLS = ["start_date", "primary_completion_date", "completion_date"]
+CSV_DO_CLEAN = True                  # set to False later to skip cleaning entirely
+CSV_STRIP_WS = True                  # Leading/Trailing whitespace
+CSV_COLLAPSE_WS = False              # tabs/line-breaks/dup spaces
+CSV_CASE_MODE = "upper"              # "none"|"upper"|"lower"|"title"
+CSV_REPLACE_NULLS_STRINGS = True
+CSV_REPLACE_NULLS_NUMBERS = True
+CSV_DROP_ROWS = True                 # drop rows all-empty across the cleaned scope (all cols here)
+CSV_DROP_COLS = True                 # drop columns that are entirely null after cleaning
+CSV_REMOVE_PUNCTUATION = True        # optional extra to mirror Alteryx "Punctuation"
 
+CT_KEYWORDS = '|'.join(map(re.escape, ['DRUG', 'BIOLOGICAL']))
 
-    # 2) CREATING DATAFRAME
-    
-    CT_gov_initial = pd.read_csv(csv_path)
-    CT_gov_initial = to_datetime_cols(CT_gov_initial, DATE_COLS)
 
+def _raw_columns(csv_path: str, columns: Iterable[str] | None) -> list[str] | None:
+    # Column pruning works on raw header names; the filter column is always read
+    if columns is None:
+        return None
+    inverse = {new: old for old, new in CT_RENAMES.items()}
+    raw_keep = list(dict.fromkeys([inverse.get(c, c) for c in columns] + [CT_FILTER_COL]))
+
+    header = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    skipped = [c for c in header if c not in set(raw_keep)]
+    print(f"[CT_GOV_Cleaning] Reading {len(header) - len(skipped)} of {len(header)} columns; "
+          f"skipped {len(skipped)}: {skipped}")
+    return raw_keep
+
+
+def _keyword_key(s: pd.Series) -> pd.Series:
+    # same per-cell transform the cleaning applies before the keyword filter
+    if CSV_DO_CLEAN:
+        s = s.astype("string")
+        if CSV_REPLACE_NULLS_STRINGS:
+            s = s.fillna("")
+        s = clean_text_series(s, CSV_STRIP_WS, CSV_COLLAPSE_WS, CSV_CASE_MODE, remove_punct=CSV_REMOVE_PUNCTUATION)
+    return s
+
+
+def read_ct_raw(csv_path: str, columns: Iterable[str] | None = None, chunksize: int | None = None) -> tuple[pd.DataFrame, set[str]]:
+    """
+    Raw CT.gov rows (dates parsed) plus the set of raw columns holding at least one value anywhere in the file.
+    With chunksize the CSV is streamed and each block is keyword-filtered as it is read; only survivors are kept.
+    """
+    raw_keep = _raw_columns(csv_path, columns)
+    usecols = None
+    if raw_keep is not None:
+        wanted = set(raw_keep)
+        usecols = lambda c: c in wanted   # callable: columns missing from the file are simply not read
+
+    if not chunksize:
+        raw = pd.read_csv(csv_path, usecols=usecols, dtype=CT_TEXT_DTYPES)
+        if raw_keep is not None:
+            raw = raw[[c for c in raw_keep if c in raw.columns]]
+        raw = to_datetime_cols(raw, DATE_COLS)
+        return raw, {c for c in raw.columns if raw[c].notna().any()}
+
+    # Streaming: filter + prune each block, keep only survivors.
+    # Survivors keep the dtype each block was parsed with; pd.concat unifies them the same way pandas'
+    # low_memory reader does for the eager path. Null-column drops are decided over ALL rows, as eagerly.
+    kept: list[pd.DataFrame] = []
+    seen_values: set[str] = set()
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=usecols, dtype=CT_TEXT_DTYPES):
+        if raw_keep is not None:
+            chunk = chunk[[c for c in raw_keep if c in chunk.columns]]
+
+        for c in chunk.columns:
+            if c not in seen_values:
+                vals = pd.to_datetime(chunk[c], errors="coerce") if c in DATE_COLS else chunk[c]
+                if vals.notna().any():
+                    seen_values.add(c)
+
+        key = _keyword_key(chunk[CT_FILTER_COL])
+        kept.append(chunk.loc[key.astype('string').str.contains(CT_KEYWORDS, case=False, na=False)])
+
+    raw = to_datetime_cols(pd.concat(kept), DATE_COLS)
+    return raw, seen_values
+
+
+def clean_ct_frame(raw: pd.DataFrame, executor=None, timings: dict[str, float] | None = None) -> pd.DataFrame:
+    # Row-by-row part of the cleaning (text rules, empty-row drop, keyword filter); column drops are in finalize_ct_frame
+    CT_gov_initial = raw
     if CSV_DO_CLEAN:
         CT_gov_initial = clean_selected_columns(
         CT_gov_initial,
@@ -34,25 +114,76 @@ def CT_GOV_Cleaning(csv_path: str, output_path: str | None = None) -> pd.DataFra
         collapse_ws=CSV_COLLAPSE_WS,
         case_mode=CSV_CASE_MODE,
         drop_rows=CSV_DROP_ROWS,
-        drop_cols=CSV_DROP_COLS)
+        drop_cols=False,
+        executor=executor,
+        timings=timings)
         if CSV_REMOVE_PUNCTUATION:
-            remove_punctuation_inplace(CT_gov_initial)
+            remove_punctuation_inplace(CT_gov_initial, executor=executor, timings=timings)
 
     # 3) FILTERING DATA BASIS KEYWORDS
-    terms = ['DRUG', 'BIOLOGICAL']
-    keywords = '|'.join(map(re.escape, terms))
-    CT_gov_initial['sex'].replace('ALL', 'BOTH', inplace=True)
-    CT_gov_initial = CT_gov_initial.rename(columns={'NCT id': 'NCT ID','sex':'Patient Gender'}) 
-    CT_gov_initial = CT_gov_initial[CT_gov_initial['interventions'].astype('string').str.contains(keywords, case=False, na=False)].copy()
+    if 'sex' in CT_gov_initial.columns:
+        CT_gov_initial['sex'] = CT_gov_initial['sex'].replace('ALL', 'BOTH')
+    CT_gov_initial = CT_gov_initial.rename(columns=CT_RENAMES)
+    return CT_gov_initial[CT_gov_initial[CT_FILTER_COL].astype('string').str.contains(CT_KEYWORDS, case=False, na=False)].copy()
+
+
+def finalize_ct_frame(df: pd.DataFrame, nonnull_cols: set[str], columns: Iterable[str] | None = None) -> pd.DataFrame:
+    # Whole-table steps: drop columns that were empty in the entire file, project, compact dtypes
+    CT_gov_initial = df
+    if CSV_DO_CLEAN and CSV_DROP_COLS:
+        nonnull = {CT_RENAMES.get(c, c) for c in nonnull_cols}
+        CT_gov_initial = CT_gov_initial.drop(columns=[
+            c for c in CT_gov_initial.columns if c not in nonnull and CT_gov_initial[c].isna().all()])
+    if columns is not None:
+        CT_gov_initial = CT_gov_initial[[c for c in CT_gov_initial.columns if c in set(columns)]]
+    else:
+        CT_gov_initial = CT_gov_initial.copy()
+    if not COMPACT_DTYPES:
+        for c in CT_CATEGORY_COLS:
+            if c in CT_gov_initial.columns:
+                CT_gov_initial[c] = CT_gov_initial[c].astype("category")
+        return CT_gov_initial
+    compact = apply_schema(CT_gov_initial, category=CT_CATEGORY_COLS)
+    if PRINT_MEMORY_REPORT:
+        memory_report("CT_GOV_Cleaning", CT_gov_initial, compact)
+    return compact
+
+
+def CT_GOV_Cleaning(csv_path: str, output_path: str | None = None, chunksize: int | None = None,
+    columns: Iterable[str] | None = None, workers: int | None = None, delta_dir: str | Path | None = None) -> pd.DataFrame:
+    # chunksize: stream the CSV in blocks of this many rows; each block is keyword-filtered before any cleaning
+    # columns:   output columns to keep (pipeline names, e.g. "NCT ID"); None keeps everything. output_path is only
+    #            written without it
+    # workers:   >1 cleans the text columns on a process pool of this size and prints per-column timings
+    # delta_dir: keep the cleaned rows here and, on the next refresh, only clean rows that are new or changed
+
+    # 2) CREATING DATAFRAME
+    raw, nonnull_cols = read_ct_raw(csv_path, columns, chunksize)
+
+    timings: dict[str, float] = {}
+    with text_cleaning_pool(workers) as pool:
+        clean = lambda part: clean_ct_frame(part, executor=pool, timings=timings)
+        if delta_dir:
+            CT_gov_initial = incremental_clean("ct_gov", raw, key="NCT id", clean=clean, state_dir=delta_dir,
+                settings=settings_fingerprint(sys.modules[__name__], Utils))
+        else:
+            CT_gov_initial = clean(raw)
+    if workers and workers > 1:
+        print_clean_timings("CT_GOV_Cleaning", timings)
+
+    CT_gov_initial = finalize_ct_frame(CT_gov_initial, nonnull_cols, columns)
 
 
     # 4) OPTIONAL OUTPUT (for quick inspection)
         # Save a DataFrame to CSV / Excel / Parquet based on the file extension
-    if output_path:
+        # Only the full clean is written: a projected read would replace the workbook with a few columns
+    if output_path and columns is not None:
+        print(f"[CT_GOV_Cleaning] Not writing '{output_path}': only {len(CT_gov_initial.columns)} projected columns were read "
+              f"(CT_PROJECT_COLUMNS=False writes the full clean)")
+    elif output_path:
         try:
             save_df(CT_gov_initial, output_path, index=False)
         except PermissionError as e:
-            from pathlib import Path
             alt = Path(output_path).with_suffix(".csv")
             CT_gov_initial.to_csv(alt, index=False)
             print(f"[WARN] Couldn’t write Excel '{output_path}' "
@@ -61,4 +192,3 @@ def CT_GOV_Cleaning(csv_path: str, output_path: str | None = None) -> pd.DataFra
         except Exception as e:
             print(f"[WARN] Skipping write of '{output_path}': {e}")
     return CT_gov_initial
-
@@ -0,0 +1,95 @@
+from __future__ import annotations
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable
+import numpy as np
+import pandas as pd
+from Snapshot_Cache import read_manifest, atomic_write_text, write_frame, read_frame
+
+# Bump when the stored state layout changes so old states are ignored
+DELTA_FORMAT = 1
+
+
+def _row_hashes(raw: pd.DataFrame) -> np.ndarray:
+    # one uint64 per row over every raw column (a changed "Last Modified Date" changes the hash too)
+    return pd.util.hash_pandas_object(raw, index=False).to_numpy()
+
+
+def incremental_clean(
+    name: str,
+    raw: pd.DataFrame,
+    *,
+    key: str,
+    clean: Callable[[pd.DataFrame], pd.DataFrame],
+    settings: str,
+    state_dir: str | Path) -> pd.DataFrame:
+    """
+    Clean `raw` re-using the cleaned rows of the previous refresh.
+    Rows are matched on `key` and compared by row hash; only inserted/updated rows go through `clean`, rows whose
+    key disappeared are dropped, and the result is ordered like `raw`, so it equals clean(raw).
+    `clean` must work row by row and keep the index (whole-table steps such as column drops run afterwards).
+    Rows with a missing or duplicated key are always re-cleaned. A change of `settings` or of the raw column
+    layout/dtypes triggers a full clean.
+    """
+    state = Path(state_dir)
+    state.mkdir(parents=True, exist_ok=True)
+    manifest_path = state / f"{name}.json"
+    manifest = read_manifest(manifest_path)
+
+    schema = [[str(c), str(t)] for c, t in raw.dtypes.items()]
+    row_hash = _row_hashes(raw)
+    keys = raw[key]
+    matchable = (keys.notna() & ~keys.duplicated(keep=False)).to_numpy()
+
+    # 1) previous state (only if it was produced by the same cleaning code on the same raw layout)
+    prev_rows = prev_hashes = None
+    if (manifest.get("format") == DELTA_FORMAT and manifest.get("settings") == settings
+            and manifest.get("schema") == schema and manifest.get("key") == key):
+        try:
+            prev_rows = read_frame(state / manifest["rows"])
+            prev_hashes = read_frame(state / manifest["hashes"])
+        except Exception as e:
+            prev_rows = prev_hashes = None
+            print(f"[WARN] Couldn’t read delta state for '{name}': {e}\n"
+                  f"       Cleaning all rows.")
+
+    # 2) full clean / delta clean
+    if prev_rows is None:
+        out = clean(raw)
+        print(f"[Delta_Ingest] '{name}': full clean ({len(raw):,} rows)")
+    else:
+        pos = np.flatnonzero(matchable)
+        idx = pd.Index(prev_hashes["key"]).get_indexer(keys.iloc[pos])
+        hit = idx >= 0
+        found, found_idx = pos[hit], idx[hit]
+
+        unchanged = np.zeros(len(raw), dtype=bool)
+        unchanged[found] = prev_hashes["hash"].to_numpy()[found_idx] == row_hash[found]
+
+        # carried-over rows move from their old row label to the new one
+        relabel = pd.Series(raw.index[found], index=prev_hashes["pos"].to_numpy()[found_idx])[unchanged[found]]
+        kept = prev_rows[prev_rows.index.isin(relabel.index)]
+        kept.index = relabel.loc[kept.index].to_numpy()
+
+        delta = clean(raw[~unchanged])
+        parts = [p for p in (kept, delta) if len(p)] or [delta]
+        out = pd.concat(parts).sort_index(kind="stable") if len(parts) > 1 else parts[0]
+
+        n_updated = int(hit.sum() - unchanged.sum())
+        print(f"[Delta_Ingest] '{name}': {len(raw) - len(found):,} inserted, {n_updated:,} updated, "
+              f"{len(prev_hashes) - len(found):,} deleted, {int(unchanged.sum()):,} unchanged "
+              f"(cleaned {int((~unchanged).sum()):,} of {len(raw):,} rows)")
+
+    # 3) store the new state (cleaned rows + one hash per matchable key)
+    hashes = pd.DataFrame({"key": keys[matchable].to_numpy(), "pos": raw.index[matchable], "hash": row_hash[matchable]})
+    token = hashlib.sha256(row_hash.tobytes() + settings.encode("utf-8")).hexdigest()[:16]
+    rows_path = write_frame(out, state / f"{name}-rows-{token}")
+    hashes_path = write_frame(hashes, state / f"{name}-hashes-{token}")
+    atomic_write_text(manifest_path, json.dumps({"format": DELTA_FORMAT, "key": key, "settings": settings,
+        "schema": schema, "rows": rows_path.name, "hashes": hashes_path.name}, indent=2))
+
+    for old in (manifest.get("rows"), manifest.get("hashes")):
+        if old and old not in (rows_path.name, hashes_path.name):
+            (state / old).unlink(missing_ok=True)
+    return out
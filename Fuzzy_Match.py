@@ -0,0 +1,106 @@
+from __future__ import annotations
+import hashlib
+import json
+import math
+from pathlib import Path
+import numpy as np
+from Snapshot_Cache import read_manifest, atomic_write_text
+
+# Bump when scoring changes so persisted matches are recomputed
+FUZZY_FORMAT = 1
+
+# Company-form words ignored when comparing names ("pfizer inc" ~ "pfizer")
+LEGAL_SUFFIXES = frozenset([
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "llc", "plc", "ag", "sa",
+    "nv", "bv", "gmbh", "kg", "spa", "srl", "ab", "as", "oy", "kk", "pty", "lp", "holdings", "group"])
+
+
+def _trigrams(text: str) -> set[str]:
+    words = text.lower().split()
+    core = [w for w in words if w not in LEGAL_SUFFIXES] or words
+    t = f"  {' '.join(core)} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def build_trigram_index(keys: list[str]) -> dict:
+    """
+    Blocking index over the (already normalised) mapping keys.
+      postings: trigram -> ids of the keys containing it
+      indptr/tri_ids: each key's distinct trigram ids (CSR layout), sizes: trigrams per key
+    """
+    vocab: dict[str, int] = {}
+    postings: list[list[int]] = []
+    indptr = [0]
+    tri_ids: list[int] = []
+    for kid, key in enumerate(keys):
+        for g in _trigrams(key) if key else ():
+            tid = vocab.setdefault(g, len(vocab))
+            if tid == len(postings):
+                postings.append([])
+            postings[tid].append(kid)
+            tri_ids.append(tid)
+        indptr.append(len(tri_ids))
+    return {"vocab": vocab,
+            "postings": [np.asarray(p, dtype=np.int64) for p in postings],
+            "indptr": np.asarray(indptr, dtype=np.int64),
+            "tri_ids": np.asarray(tri_ids, dtype=np.int64),
+            "sizes": np.diff(np.asarray(indptr, dtype=np.int64))}
+
+
+def _best_match(index: dict, query: str, threshold: float) -> tuple[int, float]:
+    # Dice on trigram sets. A key scoring >= threshold shares at least `need` trigrams with the query, so it must
+    # contain one of the query's (n - need + 1) rarest trigrams: only those posting lists are read (prefix filter).
+    q = [index["vocab"][g] for g in _trigrams(query) if g in index["vocab"]]
+    n = len(_trigrams(query))
+    need = max(1, math.ceil(threshold * n / (2 - threshold)))
+    if len(q) < need:
+        return -1, 0.0
+    q.sort(key=lambda tid: len(index["postings"][tid]))
+    cand = np.unique(np.concatenate([index["postings"][tid] for tid in q[: len(q) - need + 1]]))
+
+    # exact overlap for the candidates only: gather their trigram ids and count hits per key
+    starts, sizes = index["indptr"][cand], index["sizes"][cand]
+    seg = np.repeat(np.arange(len(cand)), sizes)
+    flat = index["tri_ids"][np.repeat(starts, sizes) + (np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes))]
+    overlap = np.bincount(seg[np.isin(flat, q)], minlength=len(cand))
+    score = 2.0 * overlap / (n + sizes)
+    best = int(np.argmax(score))           # ties -> first key in table order
+    if score[best] < threshold:
+        return -1, float(score[best])
+    return int(cand[best]), float(score[best])
+
+
+def fuzzy_match(keys: list[str], queries: list[str], *, threshold: float = 0.85, index: dict | None = None,
+    cache_dir: str | Path | None = None, label: str = "mapping", memo: dict | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Best mapping key (position in `keys`, -1 if none >= threshold) and its Dice score for every query.
+    memo: results for these keys and threshold kept by the caller between calls (Revenue_Mapping keeps one per lookup).
+    With cache_dir, results also persist per (keys, threshold). Only query strings found in neither are scored.
+    """
+    index = build_trigram_index(keys) if index is None else index
+
+    cache = {} if memo is None else memo
+    cache_path = None
+    if cache_dir and any(q and q not in cache for q in queries):
+        digest = hashlib.sha256(json.dumps([FUZZY_FORMAT, threshold, keys]).encode("utf-8")).hexdigest()[:16]
+        cache_path = Path(cache_dir) / f"fuzzy_{label}_{digest}.json"
+        for q, hit in read_manifest(cache_path).items():
+            cache.setdefault(q, hit)
+
+    pos = np.full(len(queries), -1, dtype=np.int64)
+    score = np.zeros(len(queries), dtype=float)
+    new = 0
+    for i, q in enumerate(queries):
+        if not q:
+            continue
+        if q not in cache:
+            cache[q] = _best_match(index, q, threshold)
+            new += 1
+        pos[i], score[i] = cache[q]
+
+    if cache_path is not None and new:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(cache_path, json.dumps(dict(cache)))
+    print(f"[Fuzzy_Match] '{label}': {int((pos >= 0).sum())} of {len(queries)} names matched "
+          f"(threshold {threshold}, {new} scored, {len(queries) - new} from cache)")
+    return pos, score
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+class JobRunner:
+    """
+    Bounded background runner for pipeline jobs.
+      - at most `workers` jobs run at once; further submissions queue up to `max_pending` jobs in total,
+        beyond that submit() raises JobQueueFull
+      - a job is fn(progress, *args); it calls progress("stage name") when it enters a stage, which records
+        per-stage timings and the % done out of `stages`
+      - the last `keep` finished jobs (and their results) stay available
+    """
+
+    def __init__(self, stages: list[str], workers: int = 2, max_pending: int = 8, keep: int = 200):
+        self.stages = list(stages)
+        self.max_pending = max_pending
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, dict] = OrderedDict()
+
+    def submit(self, fn: Callable[..., Any], *args, label: str = "") -> str:
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+            if active >= self.max_pending:
+                raise JobQueueFull(f"{active} jobs already queued or running (limit {self.max_pending})")
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {"id": job_id, "label": label, "status": "queued", "stage": None, "stages": [],
+                                  "submitted": time.time(), "started": None, "finished": None,
+                                  "result": None, "error": None}
+        self._pool.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def _progress(self, job_id: str, stage: str) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stages"] and job["stages"][-1]["seconds"] is None:
+                job["stages"][-1]["seconds"] = round(now - job["stages"][-1]["_t0"], 3)
+            if stage is not None:
+                job["stages"].append({"stage": stage, "seconds": None, "_t0": now})
+            job["stage"] = stage
+
+    def _run(self, job_id: str, fn: Callable[..., Any], args: tuple) -> None:
+        with self._lock:
+            self._jobs[job_id].update(status="running", started=time.time())
+        try:
+            result = fn(lambda stage: self._progress(job_id, stage), *args)
+            self._progress(job_id, None)
+            with self._lock:
+                self._jobs[job_id].update(status="done", result=result, finished=time.time())
+        except Exception as e:
+            self._progress(job_id, None)
+            print(f"[WARN] Job {job_id} failed: {type(e).__name__}: {e}\n{traceback.format_exc()}")
+            with self._lock:
+                self._jobs[job_id].update(status="failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+        finally:
+            self._trim()
+
+    def _trim(self) -> None:
+        with self._lock:
+            finished = [k for k, j in self._jobs.items() if j["status"] in ("done", "failed")]
+            for k in finished[: max(0, len(finished) - self.keep)]:
+                del self._jobs[k]
+
+    def status(self, job_id: str) -> dict | None:
+        # JSON-ready view of a job (without its result)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            done_stages = sum(1 for s in job["stages"] if s["seconds"] is not None)
+            if job["status"] == "done":
+                progress = 100
+            else:
+                progress = int(100 * min(done_stages, len(self.stages)) / max(1, len(self.stages)))
+            ahead = 0
+            if job["status"] == "queued":
+                ahead = sum(1 for k, j in self._jobs.items() if j["status"] == "queued" and j["submitted"] < job["submitted"])
+            return {
+                "job_id": job["id"], "label": job["label"], "status": job["status"], "step": job["stage"],
+                "progress": progress, "queued_ahead": ahead, "error": job["error"],
+                "stages": [{"stage": s["stage"], "seconds": s["seconds"]} for s in job["stages"]],
+                "submitted": job["submitted"], "started": job["started"], "finished": job["finished"],
+                "elapsed": round((job["finished"] or time.time()) - (job["started"] or job["submitted"]), 3)}
+
+    def result(self, job_id: str) -> Any:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else job["result"]
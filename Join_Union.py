@@ -2,82 +2,144 @@ from __future__ import annotations
 from typing import Iterable, Tuple
 import pandas as pd
 import numpy as np
+from functools import partial
 from pathlib import Path
 import re
-from pandas.api.types import is_object_dtype
-from Utils import save_df
+from Utils import frame_memo, map_distinct, sponsor_head
+from Output_Writer import write_output, sanitize_frame, run_concurrently, seed_concat_fixes
+
+# CT columns carried into the join by default (NCT ID is the key)
+CT_RIGHT_COLS_DEFAULT = ["NCT ID", "study title", "study status", "interventions", "condition"]
+
+def required_ct_columns(right_cols_to_keep: Iterable[str] | None = None) -> list[str]:
+    # CT columns the join stage reads; pushed down into CT_GOV_Cleaning(columns=...) so nothing else is parsed
+    cols = list(CT_RIGHT_COLS_DEFAULT if right_cols_to_keep is None else right_cols_to_keep)
+    return list(dict.fromkeys(["NCT ID", *cols]))
 
 def _prep_right_subset(ct_df: pd.DataFrame, right_cols: Iterable[str]) -> pd.DataFrame:
-    keep = set(right_cols) if right_cols is not None else set()
-    keep.add("NCT ID")  # join key must be present
-    keep = [c for c in keep if c in ct_df.columns] # Intersect with actual columns to be safe
+    keep = ["NCT ID", *(right_cols or [])]  # join key must be present
+    keep = [c for c in dict.fromkeys(keep) if c in ct_df.columns] # Intersect with actual columns to be safe
     return ct_df.loc[:, keep].copy()
 
+def _no_nct_code(nct: pd.Series) -> pd.Series:
+    return nct.astype("string").str.strip().str.casefold().eq("no nct code").fillna(False)
+
+def _build_nct_index(ct_df: pd.DataFrame) -> tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+    # Sorted distinct CT keys + CT row positions grouped by key: key i owns order[starts[i]:starts[i] + counts[i]]
+    codes, uniques = pd.factorize(ct_df["NCT ID"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]               # rows without a key never match
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    return pd.Index(uniques), order, starts, counts
+
+def nct_index(ct_df: pd.DataFrame) -> tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+    # built once per CT frame and re-used by every request
+    return frame_memo(ct_df, "nct_index", _build_nct_index)
+
 def _sanitize_for_excel(df: pd.DataFrame) -> pd.DataFrame:
-    #Remove illegal control chars and truncate long cells to Excel's limit
-    out = df.copy()
-    bad = re.compile(r"[\x00-\x08\x0B-\x0C\x0E-\x1F]")
-    for c in out.columns:
-        if is_object_dtype(out[c]) or str(out[c].dtype) == "string":
-            s = out[c].astype("string").fillna("")
-            s = s.str.replace(bad, "", regex=True)
-            s = s.str.slice(0, 32760)  # Excel cell text limit is 32767
-            out[c] = s
-    return out
+    #Remove illegal control chars and truncate long cells to Excel's limit (only the affected cells are rewritten)
+    return sanitize_frame(df)
 
-def join_tt_ct_on_nct(tt_df: pd.DataFrame, ct_df: pd.DataFrame, right_cols_to_keep: Iterable[str], suffix_for_ct: str = "_CT") -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def save_sanitized(df: pd.DataFrame, path: str) -> None:
+    # .xlsx: the streaming writer cleans cells inline (no sanitized copy of the frame)
+    try:
+        write_output(df, path, sanitize=True)
+    except Exception as e:
+        # Fallback to CSV so your run still completes
+        alt = Path(path).with_suffix(".csv")
+        _sanitize_for_excel(df).to_csv(alt, index=False)
+        print(f"[WARN] Couldn’t write Excel '{path}': {e}\n"
+            f"        Wrote CSV fallback: '{alt}'.")
 
-    # 1) Reduce CT to selected columns (+ key)
-    ct_sub = _prep_right_subset(ct_df, right_cols_to_keep)
+def join_tt_ct_on_nct(tt_df: pd.DataFrame, ct_df: pd.DataFrame, right_cols_to_keep: Iterable[str], suffix_for_ct: str = "_CT") -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # Returns (join, left_only) as the Alteryx J/L outputs; CT rows without a TT match are never built.
+    # Rows come out in the order the former full outer merge produced: sorted by NCT ID, TT order within a key.
 
-    # 2) Build a mapping of CT columns to rename with a suffix
-    ct_nonkey = [c for c in ct_sub.columns if c != "NCT ID"]
-    ct_sub_renamed = ct_sub.rename(columns={c: f"{c}{suffix_for_ct}" for c in ct_nonkey})
+    # 1) Reduce CT to selected columns (+ key), renaming the non-key ones with a suffix (once per CT frame)
+    def build_right(ct: pd.DataFrame) -> pd.DataFrame:
+        ct_sub = _prep_right_subset(ct, right_cols_to_keep)
+        ct_nonkey = [c for c in ct_sub.columns if c != "NCT ID"]
+        return ct_sub.rename(columns={c: f"{c}{suffix_for_ct}" for c in ct_nonkey})
+    ct_sub_renamed = frame_memo(ct_df, ("join_right", tuple(right_cols_to_keep or ()), suffix_for_ct), build_right)
 
-    # 3) Do a full indicator merge to partition into L/J/R like Alteryx
-    merged = tt_df.merge(
-        ct_sub_renamed,
-        how="outer",               # full outer so we can extract all three buckets
-        left_on="NCT ID",
-        right_on="NCT ID",
-        indicator=True,
-        suffixes=("", suffix_for_ct))
-    
+    # 2) Probe the CT key index with the TT keys ("No NCT Code" rows go straight to left-only)
+    keys, order, starts, counts = nct_index(ct_df)
+    tt_keys = tt_df["NCT ID"]
+    code = np.full(len(tt_df), -1, dtype=np.int64)
+    probe = ~_no_nct_code(tt_keys).to_numpy()
+    code[probe] = keys.get_indexer(tt_keys[probe])
+
+    # 3) Join: each matched TT row repeated once per CT row with its key (key-sorted, stable)
+    matched = np.flatnonzero(code >= 0)
+    matched = matched[np.argsort(code[matched], kind="stable")]
+    n = counts[code[matched]]
+    left_pos = np.repeat(matched, n)
+    offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    right_pos = order[np.repeat(starts[code[matched]], n) + offsets]
+
+    join_df = pd.concat([
+        tt_df.iloc[left_pos].reset_index(drop=True),
+        ct_sub_renamed.iloc[right_pos].drop(columns=["NCT ID"]).reset_index(drop=True)], axis=1)
 
-    # 4) Partition results
-    join_df = merged[merged["_merge"] == "both"].drop(columns=["_merge"])
-    left_only_df = merged.loc[merged["_merge"] == "left_only", tt_df.columns].copy()
-    right_only_df = merged[merged["_merge"] == "right_only"].drop(columns=[c for c in tt_df.columns if c in merged.columns] + ["_merge"])
+    # 4) Left only
+    unmatched = np.flatnonzero(code < 0)
+    left_only_df = tt_df.iloc[unmatched[tt_keys.iloc[unmatched].argsort(kind="stable").to_numpy()]].copy()
 
-    return join_df, left_only_df, right_only_df
+    return join_df, left_only_df
+
+STUDY_TEXT_COLS = ["TT_Study Design", "Treatment Plan", "Study Keywords"]   # TT columns the study-type patterns scan
 
 def _tt_text_blob(df: pd.DataFrame) -> pd.Series:
     def S(col: str) -> pd.Series:
         return df[col].astype("string") if col in df.columns else pd.Series("", index=df.index, dtype="string")
-    return S("TT_Study Design").str.cat([S("Treatment Plan"), S("Study Keywords")], sep=" ", na_rep="").str.upper()
+    first, *rest = STUDY_TEXT_COLS
+    return S(first).str.cat([S(c) for c in rest], sep=" ", na_rep="").str.upper()
 
 
 PATT_STAGE1_BASE = r"(RANDOM|CONTROL|DOUBLE[\s-]?BLIND|PLACEBO|INTERVENTION)"
 
-def stage1_base_filter(df: pd.DataFrame) -> pd.DataFrame:
-    blob = _tt_text_blob(df)
-    mask = blob.str.contains(PATT_STAGE1_BASE, regex=True, na=False)
-    return df.loc[mask].copy()
-
 # Stage-2: refine by checkboxes on the already base-filtered rows
 PATT_INTERVENTIONAL = PATT_STAGE1_BASE  # same six tokens
 PATT_OBSERVATIONAL  = r"(OBSERVATION|NON[\s-]?INTERVENTIONAL)"  # covers hyphen/space
 
-def add_study_type_column(df: pd.DataFrame) -> pd.DataFrame:
-    """Create Bain_StudyType = Interventional / Observational / Ambiguous / Unknown
-       by scanning TT_Study Design, Treatment Plan, Study Keywords."""
-    blob = _tt_text_blob(df)
+# Both token groups in one pattern. The lookahead tries every start position, so overlapping hits are all seen
+# (e.g. "NON-INTERVENTIONAL" is observational AND contains INTERVENTION), exactly like two separate scans.
+_RX_STUDY = re.compile(f"(?=(?:(?P<i>{PATT_INTERVENTIONAL})|(?P<o>{PATT_OBSERVATIONAL})))")
+
+def _classify_text(text: str) -> tuple[bool, bool]:
+    inter = obs = False
+    for m in _RX_STUDY.finditer(text):
+        if m.lastgroup == "i":
+            inter = True
+        else:
+            obs = True
+        if inter and obs:
+            break
+    return inter, obs
+
+def _build_study_flags(df: pd.DataFrame) -> pd.DataFrame:
+    # one blob, one scan per distinct blob value -> inter/obs flags per row
+    codes, uniques = pd.factorize(_tt_text_blob(df).fillna(""))
+    hits = np.array([_classify_text(t) for t in uniques], dtype=bool).reshape(-1, 2)
+    return pd.DataFrame({"inter": hits[codes, 0], "obs": hits[codes, 1]}, index=df.index)
 
-    inter_mask = blob.str.contains(PATT_INTERVENTIONAL, regex=True, na=False)
-    obs_mask   = blob.str.contains(PATT_OBSERVATIONAL,  regex=True, na=False)
+def study_flags(df: pd.DataFrame) -> pd.DataFrame:
+    return frame_memo(df, "study_flags", _build_study_flags)
+
+def stage1_base_filter(df: pd.DataFrame) -> pd.DataFrame:
+    flags = study_flags(df)
+    mask = flags["inter"].to_numpy()
+    out = df.loc[mask].copy()
+    frame_memo(out, "study_flags", lambda _: flags.loc[mask])   # Stage 2 reads these instead of re-scanning
+    return out
 
-    df = df.copy()
-    df["Bain_StudyType"] = np.select(
+def study_type(df: pd.DataFrame) -> pd.Series:
+    """Interventional / Observational / Ambiguous / Unknown per row, by scanning TT_Study Design, Treatment Plan,
+       Study Keywords."""
+    flags = study_flags(df)
+    inter_mask, obs_mask = flags["inter"], flags["obs"]
+    return pd.Series(np.select(
         [
             inter_mask & ~obs_mask,
             obs_mask & ~inter_mask,
@@ -85,8 +147,15 @@ def add_study_type_column(df: pd.DataFrame) -> pd.DataFrame:
         ],
         ["Interventional", "Observational", "Ambiguous"],
         default="Unknown"
-    ).astype("string")
-    return df
+    ), index=df.index, dtype="string")
+
+def add_study_type_column(df: pd.DataFrame) -> pd.DataFrame:
+    """Create Bain_StudyType (see study_type)."""
+    out = df.copy()
+    out["Bain_StudyType"] = study_type(df)
+    flags = study_flags(df)
+    frame_memo(out, "study_flags", lambda _: flags)
+    return out
 
 def stage2_refine_by_flags(df: pd.DataFrame, interventional: bool | None, observational: bool | None) -> pd.DataFrame:
     # If neither box is checked/provided -> skip refinement
@@ -106,6 +175,55 @@ def stage2_refine_by_flags(df: pd.DataFrame, interventional: bool | None, observ
 
     return df.loc[df["Bain_StudyType"].isin(selected)].copy()
 
+def sponsor_type_tags(sponsor_type: pd.Series) -> tuple[pd.Series, np.ndarray]:
+    # cleaned type: first line, before first comma, trimmed, Title Case (once per distinct value); tag: Industry / Academic / Others
+    cleaned = map_distinct(sponsor_type.astype("string"), sponsor_head)
+    mc = cleaned.astype("string").str.strip().str.casefold()
+    is_industry, is_academic = (mc.eq(v).fillna(False).to_numpy(bool) for v in ("industry", "academic"))   # null type -> Others
+    return cleaned, np.select([is_industry, is_academic], ["Industry", "Academic"], default="Others")
+
+def build_base_left(left_only_df: pd.DataFrame) -> pd.DataFrame:
+    """Request-independent part of the Left branch: "No NCT Code" rows with the sponsor-type tag, the Stage-1 base
+       filter and Bain_StudyType. The checkboxes only select rows from it (see select_left)."""
+    left = left_only_df.loc[_no_nct_code(left_only_df["NCT ID"])].copy()
+    cleaned, tagged = sponsor_type_tags(left["Sponsor/Collaborator Type"])
+    left["Bain_Cleaned Sponsor/Collaborator Type"] = cleaned
+    left["Bain_Cleaned Sponsor/Collaborator Type_tagged"] = tagged
+    return add_study_type_column(stage1_base_filter(left))
+
+def left_selection(
+    base_left: pd.DataFrame,
+    study_interventional: bool | None = None, study_observational: bool | None = None,
+    sponsor_industry: bool | None = None, sponsor_academic: bool | None = None, sponsor_others: bool | None = None) -> np.ndarray:
+    # Row mask over build_base_left's output; an unchecked group keeps every row
+    mask = np.ones(len(base_left), dtype=bool)
+
+    selected_tags = []
+    if sponsor_industry:  selected_tags.append("Industry")
+    if sponsor_academic:  selected_tags.append("Academic")
+    if sponsor_others:    selected_tags.append("Others")
+    if selected_tags:
+        mask &= base_left["Bain_Cleaned Sponsor/Collaborator Type_tagged"].isin(selected_tags).to_numpy()
+
+    # Stage-2: both boxes also keep ambiguous “both-signals” rows
+    selected = []
+    if study_interventional: selected.append("Interventional")
+    if study_observational:  selected.append("Observational")
+    if study_interventional and study_observational:
+        selected.append("Ambiguous")
+    if selected:
+        mask &= base_left["Bain_StudyType"].isin(selected).to_numpy()
+    return mask
+
+def select_left(base_left: pd.DataFrame, study_interventional: bool | None = None, study_observational: bool | None = None,
+                **sponsor_flags) -> pd.DataFrame:
+    mask = left_selection(base_left, study_interventional, study_observational, **sponsor_flags)
+    out = base_left.loc[mask]
+    # Bain_StudyType is only part of the output when Stage 2 ran
+    if not study_interventional and not study_observational:
+        out = out.drop(columns="Bain_StudyType")
+    return out.copy()
+
 def run_join_operation(
     TT_Initial: pd.DataFrame,
     CT_GOV_Initial: pd.DataFrame,
@@ -117,74 +235,27 @@ def run_join_operation(
     debug: bool = False, study_interventional: bool | None = None, study_observational: bool | None = None,
     sponsor_industry:  bool | None = None,
     sponsor_academic:  bool | None = None,
-    sponsor_others:    bool | None = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    sponsor_others:    bool | None = None,
+    output_workers: int = 3) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     
     if right_cols_to_keep is None:
-        right_cols_to_keep = ["NCT ID", "study title", "study status", "interventions", "condition"]    # CT columns to be used for JOIN (J)
-    join_df, left_only_df, right_only_df = join_tt_ct_on_nct(tt_df=TT_Initial, ct_df=CT_GOV_Initial, right_cols_to_keep=right_cols_to_keep, suffix_for_ct="_CT")
+        right_cols_to_keep = CT_RIGHT_COLS_DEFAULT    # CT columns to be used for JOIN (J)
+    join_df, left_only_df = join_tt_ct_on_nct(tt_df=TT_Initial, ct_df=CT_GOV_Initial, right_cols_to_keep=right_cols_to_keep, suffix_for_ct="_CT")
 
     Left_only_TT_CT = left_only_df
     Join_TT_CT = join_df
 
-    # Optional
-      
-    if output_join_path:
-        try:
-            safe_join = _sanitize_for_excel(Join_TT_CT)
-            save_df(safe_join, output_join_path, index=False)
-        except Exception as e:
-            # Fallback to CSV so your run still completes
-            alt = Path(output_join_path).with_suffix(".csv")
-            safe_join.to_csv(alt, index=False)
-            print(f"[WARN] Couldn’t write Excel '{output_join_path}': {e}\n"
-                f"        Wrote CSV fallback: '{alt}'.")
-
-    Left_only_TT_CT = Left_only_TT_CT.loc[Left_only_TT_CT["NCT ID"].astype("string").str.strip().str.casefold().eq("no nct code").fillna(False)].copy()
-    Left_only_TT_CT["Bain_Cleaned Sponsor/Collaborator Type"] = (Left_only_TT_CT["Sponsor/Collaborator Type"].astype("string")
-        .str.split(r"[\r\n]+", regex=True).str[0]   # first line
-        .str.split(",", n=1).str[0]                # before first comma
-        .str.strip().str.title())
-    tag = Left_only_TT_CT["Bain_Cleaned Sponsor/Collaborator Type"].astype("string").str.strip()
-    mc = tag.str.casefold()
-    Left_only_TT_CT["Bain_Cleaned Sponsor/Collaborator Type_tagged"] = np.select([mc.eq("industry"), mc.eq("academic")],["Industry", "Academic"],default="Others")
-    selected_tags = []
-    if sponsor_industry:  selected_tags.append("Industry")
-    if sponsor_academic:  selected_tags.append("Academic")
-    if sponsor_others:    selected_tags.append("Others")
-
-    # Apply only if at least one box is checked; otherwise skip this refinement
-    if selected_tags:
-        Left_only_TT_CT = Left_only_TT_CT.loc[
-            Left_only_TT_CT["Bain_Cleaned Sponsor/Collaborator Type_tagged"].isin(selected_tags)
-        ].copy()
-
-    Left_only_TT_CT = stage1_base_filter(Left_only_TT_CT)
-    Left_only_TT_CT = stage2_refine_by_flags(Left_only_TT_CT, interventional=study_interventional, observational=study_observational)
-
+    base_left = build_base_left(Left_only_TT_CT)
+    Left_only_TT_CT = select_left(base_left, study_interventional, study_observational, sponsor_industry=sponsor_industry,
+                                  sponsor_academic=sponsor_academic, sponsor_others=sponsor_others)
 
     Union_TT_CT = pd.concat([Left_only_TT_CT, Join_TT_CT], axis=0, ignore_index=True, sort=False)
-
     if output_union_path:
-        try:
-            safe_join = _sanitize_for_excel(Union_TT_CT)
-            save_df(safe_join, output_union_path, index=False)
-        except Exception as e:
-            # Fallback to CSV so your run still completes
-            alt = Path(output_union_path).with_suffix(".csv")
-            safe_join.to_csv(alt, index=False)
-            print(f"[WARN] Couldn’t write Excel '{output_union_path}': {e}\n"
-                f"        Wrote CSV fallback: '{alt}'.")
-
-    if output_left_path:
-        try:
-            safe_join = _sanitize_for_excel(Left_only_TT_CT)
-            save_df(safe_join, output_left_path, index=False)
-        except Exception as e:
-            # Fallback to CSV so your run still completes
-            alt = Path(output_left_path).with_suffix(".csv")
-            safe_join.to_csv(alt, index=False)
-            print(f"[WARN] Couldn’t write Excel '{output_left_path}': {e}\n"
-                f"        Wrote CSV fallback: '{alt}'.")
-    
-    
+        # Union = Left rows + Join rows: Excel fixes are taken from their scans instead of scanning the union again
+        seed_concat_fixes(Union_TT_CT, [Left_only_TT_CT, Join_TT_CT])
+
+    # Optional: independent outputs written concurrently
+    outputs = [(Join_TT_CT, output_join_path), (Union_TT_CT, output_union_path), (Left_only_TT_CT, output_left_path)]
+    run_concurrently([partial(save_sanitized, df, path) for df, path in outputs if path], workers=output_workers)
+
     return Left_only_TT_CT, Join_TT_CT, Union_TT_CT
\ No newline at end of file
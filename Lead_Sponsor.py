@@ -1,6 +1,6 @@
 from __future__ import annotations
 import pandas as pd
-from Utils import save_df
+from Utils import save_df, map_distinct, sponsor_head
 
 def add_lead_sponsor(Union_TT_CT: pd.DataFrame, output_path: str | None = None) -> pd.DataFrame:
     Union_TT_CT_Lead_Sponsor = Union_TT_CT.copy()
@@ -10,10 +10,8 @@ def add_lead_sponsor(Union_TT_CT: pd.DataFrame, output_path: str | None = None)
     if src is None:
         src = Union_TT_CT_Lead_Sponsor.get("Sponsor/Collaborator", pd.Series("", index=Union_TT_CT_Lead_Sponsor.index))
 
-    Union_TT_CT_Lead_Sponsor["Bain_Lead Sponsor"] = (src.astype("string").fillna("")
-           .str.split(r"[\r\n]+", regex=True).str[0]   # first line
-           .str.split(",", n=1).str[0]                # before first comma
-           .str.strip().str.title())
+    # first line, before first comma, trimmed, Title Case (once per distinct sponsor text)
+    Union_TT_CT_Lead_Sponsor["Bain_Lead Sponsor"] = map_distinct(src.astype("string").fillna(""), sponsor_head)
 
     if output_path:
         save_df(Union_TT_CT_Lead_Sponsor, output_path, index=False)
@@ -0,0 +1,275 @@
+from __future__ import annotations
+import datetime as dt
+import importlib.util
+import math
+import numbers
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype, is_object_dtype
+from Utils import frame_memo
+
+# Characters Excel rejects in cell text, and its cell length limit (minus a small margin, as before)
+EXCEL_ILLEGAL = re.compile(r"[\x00-\x08\x0B-\x0C\x0E-\x1F]")
+EXCEL_MAX_TEXT = 32760
+
+XLSX_CHUNK_ROWS = 10_000
+_HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}   # same look as DataFrame.to_excel
+
+
+def output_format(path: str | Path) -> str:
+    # ".csv.gz" counts as one extension
+    name = Path(path).name.lower()
+    return ".csv.gz" if name.endswith(".csv.gz") else Path(name).suffix
+
+
+def _is_text(s: pd.Series) -> bool:
+    if isinstance(s.dtype, pd.CategoricalDtype):   # enumerations from the compact schema
+        return _is_text(pd.Series(s.cat.categories))
+    return is_object_dtype(s) or str(s.dtype) == "string"
+
+
+def excel_text(v) -> str:
+    # one cell under the Excel rules: text, illegal characters removed, capped length
+    return EXCEL_ILLEGAL.sub("", v if isinstance(v, str) else str(v))[:EXCEL_MAX_TEXT]
+
+
+def _scan_text(s: pd.Series) -> dict | None:
+    # Pre-scan of one text column. Clean columns (the usual case) cost one C-level regex pass over the joined text;
+    # only when that finds something are the offending cells located. Arrow-backed strings are checked on their buffers.
+    if isinstance(s.dtype, pd.StringDtype) and s.dtype.storage.startswith("pyarrow"):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        arr = pa.chunked_array(pa.array(s.array))
+        bad = pc.or_(pc.match_substring_regex(arr, EXCEL_ILLEGAL.pattern), pc.greater(pc.utf8_length(arr), EXCEL_MAX_TEXT))
+        pos = np.flatnonzero(bad.to_numpy(zero_copy_only=False) == True)   # nulls -> False
+        vals, mixed = None, False
+    else:
+        vals = s.to_numpy(dtype=object)
+        present = vals[pd.notna(vals)]
+        try:
+            blob = "\n".join(present)
+            mixed = False
+        except TypeError:
+            present = [v for v in present if type(v) is str]
+            blob = "\n".join(present)
+            mixed = True
+        if EXCEL_ILLEGAL.search(blob) is None and max(map(len, present), default=0) <= EXCEL_MAX_TEXT:
+            pos = np.empty(0, dtype=np.int64)
+        else:
+            pos = np.array([i for i, v in enumerate(vals) if type(v) is str and
+                            (len(v) > EXCEL_MAX_TEXT or EXCEL_ILLEGAL.search(v))], dtype=np.int64)
+    if not len(pos) and not mixed:
+        return None
+    cells = (s.iloc[pos] if vals is None else vals[pos]).tolist()
+    return {"pos": pos, "values": [excel_text(v) for v in cells], "mixed": mixed}
+
+
+def _build_excel_fixes(df: pd.DataFrame) -> dict:
+    fixes = {}
+    for j, c in enumerate(df.columns):
+        col = df.iloc[:, j]
+        if _is_text(col):
+            fix = _scan_text(col)
+            if fix is not None:
+                fixes[c] = fix
+    return fixes
+
+
+def excel_fixes(df: pd.DataFrame) -> dict:
+    """
+    Cells of `df` that the Excel rules change: {column: {"pos": row positions, "values": cleaned text,
+    "mixed": column also holds non-text values}}. Memoised per frame; frames derived by row selection get theirs
+    from the source via seed_excel_fixes instead of re-scanning.
+    """
+    return frame_memo(df, "excel_fixes", _build_excel_fixes)
+
+
+def take_fixes(fixes: dict, rows: np.ndarray, columns: Iterable | None = None) -> dict:
+    # fixes of the frame made of source rows `rows` (positions into the source), limited to its `columns`
+    rows = np.asarray(rows, dtype=np.int64)
+    keep = None if columns is None else set(columns)
+    out = {}
+    for c, fix in fixes.items():
+        if keep is not None and c not in keep:
+            continue
+        pos = fix["pos"]
+        idx = np.searchsorted(pos, rows).clip(max=max(len(pos) - 1, 0))
+        hit = (pos[idx] == rows) if len(pos) else np.zeros(len(rows), dtype=bool)
+        if hit.any() or fix["mixed"]:
+            out[c] = {"pos": np.flatnonzero(hit), "values": [fix["values"][i] for i in idx[hit]], "mixed": fix["mixed"]}
+    return out
+
+
+def seed_concat_fixes(out: pd.DataFrame, parts: list[pd.DataFrame]) -> None:
+    # out = pd.concat(parts, ignore_index=True): its fixes are the parts' fixes, shifted by the rows before them
+    fixes, offset = {}, 0
+    for part in parts:
+        for c, fix in excel_fixes(part).items():
+            cur = fixes.setdefault(c, {"pos": [], "values": [], "mixed": False})
+            cur["pos"].append(fix["pos"] + offset)
+            cur["values"] += fix["values"]
+            cur["mixed"] |= fix["mixed"]
+        offset += len(part)
+    for fix in fixes.values():
+        fix["pos"] = np.concatenate(fix["pos"]).astype(np.int64)
+    # a column that is only text after the concat (e.g. numbers in one part, text in another) holds non-text values
+    for c in out.columns:
+        if c not in fixes and _is_text(out[c]) and any(c in p.columns and not _is_text(p[c]) for p in parts):
+            fixes[c] = {"pos": np.empty(0, dtype=np.int64), "values": [], "mixed": True}
+    seed_excel_fixes(out, lambda: fixes)
+
+
+def seed_excel_fixes(df: pd.DataFrame, fixes: Callable[[], dict]) -> None:
+    # fixes() runs only if df has none memoised yet
+    frame_memo(df, "excel_fixes", lambda _: fixes())
+
+
+def _column_cells(s: pd.Series, fix: dict | None = None, start: int = 0) -> list:
+    # Python values for one column chunk (rows start.. of the frame); None = blank cell.
+    # With `fix` (sanitize mode, text column) the pre-scanned cells are replaced and everything else is written as text.
+    if is_datetime64_any_dtype(s):
+        if getattr(s.dt, "tz", None) is not None:
+            s = s.dt.tz_localize(None)
+        return [None if v is pd.NaT else v.to_pydatetime(warn=False) for v in s.astype(object)]
+    if is_bool_dtype(s) or is_numeric_dtype(s):
+        return s.astype(object).where(s.notna(), None).tolist()
+    vals = s.astype(object).where(s.notna(), None).tolist()
+    if fix is not None:
+        if fix["mixed"]:
+            vals = [v if v is None or type(v) is str else str(v) for v in vals]
+        lo, hi = np.searchsorted(fix["pos"], [start, start + len(vals)])
+        for p, v in zip(fix["pos"][lo:hi], fix["values"][lo:hi]):
+            vals[p - start] = v
+    return vals
+
+
+def write_xlsx_stream(df: pd.DataFrame, path: str | Path, *, index: bool = False, sanitize: bool = False,
+                      sheet_name: str = "Sheet1") -> None:
+    """
+    Streaming .xlsx writer (xlsxwriter constant_memory): rows go to disk as they are written, so memory stays flat.
+    Columns are converted chunk by chunk; with sanitize=True text columns are cleaned for Excel inline.
+    """
+    import xlsxwriter
+
+    if index:
+        fixes = excel_fixes(df) if sanitize else {}
+        df = df.reset_index()
+        seed_excel_fixes(df, lambda: fixes)   # same rows, same text columns
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_numbers": False,
+                                         "strings_to_formulas": False, "strings_to_urls": False})
+    try:
+        ws = wb.add_worksheet(sheet_name)
+        header = wb.add_format(_HEADER_FORMAT)
+        fmt_datetime = wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        fmt_date = wb.add_format({"num_format": "yyyy-mm-dd"})
+        for c, name in enumerate(df.columns):
+            ws.write_string(0, c, str(name), header)
+
+        def write_number(r, c, v):
+            if math.isnan(v):
+                return
+            if math.isinf(v):
+                ws.write_string(r, c, "inf" if v > 0 else "-inf")
+                return
+            ws.write_number(r, c, v)
+
+        writers = {
+            str: ws.write_string,
+            bool: ws.write_boolean,
+            int: ws.write_number,
+            float: write_number,
+            dt.datetime: lambda r, c, v: ws.write_datetime(r, c, v, fmt_datetime),
+            pd.Timestamp: lambda r, c, v: ws.write_datetime(r, c, v.to_pydatetime(), fmt_datetime),
+            dt.date: lambda r, c, v: ws.write_datetime(r, c, v, fmt_date),
+        }
+
+        def fallback(r, c, v):
+            # numpy scalars / other datetime types left in object columns
+            if isinstance(v, (bool, np.bool_)):
+                ws.write_boolean(r, c, bool(v))
+            elif isinstance(v, numbers.Real):
+                write_number(r, c, float(v))
+            elif isinstance(v, dt.datetime):
+                ws.write_datetime(r, c, pd.Timestamp(v).to_pydatetime(), fmt_datetime)
+            else:
+                ws.write_string(r, c, str(v))
+
+        fixes = excel_fixes(df) if sanitize else {}
+        col_fix = [fixes.get(c) if sanitize and _is_text(df.iloc[:, j]) else None for j, c in enumerate(df.columns)]
+        for start in range(0, len(df), XLSX_CHUNK_ROWS):
+            chunk = df.iloc[start:start + XLSX_CHUNK_ROWS]
+            cols = [_column_cells(chunk.iloc[:, j], col_fix[j], start) for j in range(chunk.shape[1])]
+            for r, row in enumerate(zip(*cols), start=start + 1):
+                for c, v in enumerate(row):
+                    if v is not None:
+                        writers.get(type(v), fallback)(r, c, v)
+    finally:
+        wb.close()
+
+
+def write_output(df: pd.DataFrame, path: str | Path, *, index: bool = False, sanitize: bool = False) -> None:
+    """
+    Write `df` by extension: .xlsx (streaming with xlsxwriter, else pandas), .csv, .csv.gz, .parquet, .feather (.xls via pandas).
+    sanitize=True applies the Excel cell rules (illegal characters, length) to text columns.
+    """
+    outp = Path(path)
+    outp.parent.mkdir(parents=True, exist_ok=True)
+    ext = output_format(outp)
+    if ext == ".xlsx":
+        if importlib.util.find_spec("xlsxwriter") is not None:
+            write_xlsx_stream(df, outp, index=index, sanitize=sanitize)
+            return
+        print(f"[WARN] xlsxwriter is not installed; writing '{outp.name}' with DataFrame.to_excel (whole sheet in memory)")
+        # Excel has no time zones (the streaming writer drops them too)
+        tz_cols = [c for c in df.columns if getattr(getattr(df[c], "dt", None), "tz", None) is not None]
+        if tz_cols:
+            df = df.copy(deep=False)
+            for c in tz_cols:
+                df[c] = df[c].dt.tz_localize(None)
+    elif ext not in (".csv", ".csv.gz", ".parquet", ".feather", ".xls"):
+        raise ValueError(f"Unsupported extension: {ext} (use .xlsx, .csv, .csv.gz, .parquet, .feather, .xls)")
+    if sanitize:
+        df = sanitize_frame(df)
+    if ext == ".csv":
+        df.to_csv(outp, index=index)
+    elif ext == ".csv.gz":
+        df.to_csv(outp, index=index, compression="gzip")
+    elif ext == ".parquet":
+        df.to_parquet(outp, index=index)
+    elif ext == ".feather":
+        (df.reset_index() if index else df.reset_index(drop=True)).to_feather(outp)
+    else:
+        df.to_excel(outp, index=index)
+
+
+def sanitize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Excel rules for text columns, rewriting only the cells excel_fixes found (the frame itself if there are none)
+    fixes = excel_fixes(df)
+    if not fixes:
+        return df
+    out = df.copy(deep=False)
+    for c, fix in fixes.items():
+        if c not in out.columns or not _is_text(out[c]):   # fixes seeded from a wider source frame
+            continue
+        vals = out[c].to_numpy(dtype=object, copy=True)
+        if fix["mixed"]:
+            vals = np.array([v if v is None or type(v) is str or pd.isna(v) else str(v) for v in vals], dtype=object)
+        vals[fix["pos"]] = fix["values"]
+        out[c] = pd.Series(vals, index=out.index, dtype=out[c].dtype if str(out[c].dtype) == "string" else object)
+    return out
+
+
+def run_concurrently(tasks: list[Callable[[], None]], workers: int = 4) -> None:
+    # Independent outputs on a thread pool (compression and Parquet encoding release the GIL); re-raises the first error
+    if len(tasks) <= 1 or workers <= 1:
+        for task in tasks:
+            task()
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks)), thread_name_prefix="output") as pool:
+        futures = [pool.submit(task) for task in tasks]
+    for f in futures:
+        f.result()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+import pandas as pd
+from Snapshot_Cache import read_manifest, atomic_write_text, write_frame, read_frame
+
+
+def result_key(*parts) -> str:
+    # parts must be JSON-able (flags, snapshot keys, settings fingerprints)
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def frames_nbytes(frames: dict[str, pd.DataFrame]) -> int:
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in frames.values()))
+
+
+class ResultCache:
+    """
+    Pipeline results (a dict of named DataFrames) keyed by result_key(...).
+      - memory tier: LRU bounded by the frames' deep memory size (max_bytes)
+      - disk tier (optional, disk_dir): frames stored via Snapshot_Cache.write_frame, the `disk_entries` most recent kept
+      - concurrent calls for the same key run `compute` once; the others wait for its result
+    Cached frames are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str | Path | None = None, disk_entries: int = 64):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_entries = disk_entries
+        self._lock = threading.Lock()
+        self._mem: OrderedDict[str, tuple[dict, int]] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, dict] = {}
+
+    def get_or_compute(self, key: str, compute: Callable[[], dict[str, pd.DataFrame]], *, persist: bool = True) -> dict[str, pd.DataFrame]:
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                return hit[0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {"done": threading.Event(), "value": None, "error": None}
+
+        # 1) another request is computing this key: wait for it
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["value"]
+
+        # 2) disk tier, then compute
+        try:
+            t0 = time.perf_counter()
+            frames = self._disk_get(key) if persist else None
+            source = "disk"
+            if frames is None:
+                frames = compute()
+                source = "computed"
+                if persist:
+                    self._disk_put(key, frames)
+            self._mem_put(key, frames)
+            print(f"[Result_Cache] {key[:12]} {source} in {time.perf_counter() - t0:.2f}s "
+                  f"({len(self._mem)} in memory, {self._bytes / 2**20:,.1f} MiB)")
+            flight["value"] = frames
+            return frames
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight["done"].set()
+
+    def _mem_put(self, key: str, frames: dict[str, pd.DataFrame]) -> None:
+        size = frames_nbytes(frames)
+        with self._lock:
+            if key in self._mem:
+                self._bytes -= self._mem.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._mem[key] = (frames, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._mem.popitem(last=False)
+                self._bytes -= old_size
+
+    def _disk_get(self, key: str) -> dict[str, pd.DataFrame] | None:
+        if self.disk_dir is None:
+            return None
+        manifest_path = self.disk_dir / f"result-{key[:32]}.json"
+        manifest = read_manifest(manifest_path)
+        if manifest.get("key") != key:
+            return None
+        try:
+            frames = {name: read_frame(self.disk_dir / file) for name, file in manifest["files"].items()}
+        except Exception as e:
+            print(f"[WARN] Couldn’t read cached result '{manifest_path.name}': {e}\n"
+                  f"       Recomputing.")
+            return None
+        manifest_path.touch()
+        return frames
+
+    def _disk_put(self, key: str, frames: dict[str, pd.DataFrame]) -> None:
+        if self.disk_dir is None:
+            return
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            files = {name: write_frame(df, self.disk_dir / f"result-{key[:32]}-{name}").name for name, df in frames.items()}
+            atomic_write_text(self.disk_dir / f"result-{key[:32]}.json", json.dumps({"key": key, "files": files}, indent=2))
+        except Exception as e:
+            print(f"[WARN] Couldn’t store result {key[:12]} on disk: {e}")
+            return
+
+        # keep the most recently used entries only
+        manifests = sorted(self.disk_dir.glob("result-*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in manifests[self.disk_entries:]:
+            for file in read_manifest(old).get("files", {}).values():
+                (self.disk_dir / file).unlink(missing_ok=True)
+            old.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._mem), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
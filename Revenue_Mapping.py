@@ -1,8 +1,11 @@
 # Revenue_Mapping.py
 from __future__ import annotations
+import threading
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from Utils import save_df, clean_selected_columns, clean_text_series
+from Utils import save_df, clean_selected_columns, map_distinct, norm_key_value
+from Fuzzy_Match import build_trigram_index, fuzzy_match
 
 def _read_mapping(path: str, sheet=0) -> pd.DataFrame:
     p = Path(path)
@@ -40,11 +43,8 @@ def _read_mapping(path: str, sheet=0) -> pd.DataFrame:
                 ) from e_xlrd
 
 def _norm_key(s: pd.Series, *, remove_punct: bool = True) -> pd.Series:
-    
-    s = clean_text_series(s.astype("string"), strip_ws=True, collapse_ws=True, case_mode="lower")
-    if remove_punct:
-        s = s.str.replace(r"[^\w\s]", "", regex=True)
-    return s
+    # trimmed, single-spaced, lower case, no punctuation; memoised per distinct value (Utils.norm_key_value)
+    return map_distinct(s.astype("string"), lambda v: norm_key_value(v, remove_punct), dtype="string")
 
 def _clean_for_mapping(df: pd.DataFrame, fields_to_clean: list[str] | None,*, title_case: bool = True, remove_punct: bool = True) -> pd.DataFrame:
     out = clean_selected_columns(df=df, fields_to_clean=fields_to_clean, replace_nulls_strings=True, replace_nulls_numbers=True,
@@ -55,20 +55,103 @@ def _clean_for_mapping(df: pd.DataFrame, fields_to_clean: list[str] | None,*, ti
             out[c] = out[c].astype("string").str.replace(r"[^\w\s]", "", regex=True)
     return out
 
-def _find_replace_append(left: pd.DataFrame, lookup: pd.DataFrame, *, left_key: str, right_key: str | None = None, add_cols: list[str] | None = None) -> pd.DataFrame:
-    if right_key is None:
-        right_key = left_key
-    L = left.copy()
-    R = lookup.copy()
-
-    L["_k"] = _norm_key(L[left_key]) if left_key in L.columns else ""
-    R["_k"] = _norm_key(R[right_key]) if right_key in R.columns else ""
+# Mapping registry: each table is read and cleaned once per (file, sheet, cleaning flags) and kept with its key
+# indexes until the file's mtime/size changes. Shared by all requests (guarded by a lock).
+_REGISTRY: dict[tuple, dict] = {}
+_REGISTRY_LOCK = threading.Lock()
 
+def _registry_entry(path: str, sheet, *, cleanse: bool, title_case: bool, remove_punct: bool) -> dict:
+    p = Path(path)
+    if not p.exists():
+        raise FileNotFoundError(f"Mapping file not found: {p}")
+    st = p.stat()
+    key = (str(p.resolve()), sheet, cleanse, title_case, remove_punct)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    with _REGISTRY_LOCK:
+        entry = _REGISTRY.get(key)
+        if entry is None or entry["stamp"] != stamp:
+            table = _read_mapping(path, sheet)
+            if cleanse:
+                table = _clean_for_mapping(table, fields_to_clean=None, title_case=title_case, remove_punct=remove_punct)
+            entry = {"stamp": stamp, "table": table, "lookups": {}}
+            _REGISTRY[key] = entry
+        return entry
+
+def _build_lookup(R: pd.DataFrame, right_key: str, add_cols: list[str] | None, label: str) -> dict:
+    # normalised key -> attribute row; duplicate keys keep their first row (a merge would multiply the trials)
+    k = _norm_key(R[right_key]) if right_key in R.columns else pd.Series("", index=R.index, dtype="string")
     if add_cols is None:
         add_cols = [c for c in R.columns if c not in (right_key, "_k")]
-
-    out = L.merge(R[["_k", *add_cols]], on="_k", how="left").drop(columns=["_k"])
-    return out
+    first = ~k.duplicated(keep="first").to_numpy()
+    if right_key not in R.columns:
+        print(f"[WARN] Mapping '{label}' has no '{right_key}' column; only empty keys will match.")
+    elif not first.all():
+        print(f"[WARN] Mapping '{label}': {int((~first).sum())} row(s) repeat a '{right_key}' key; "
+              f"using the first row for each of {int(first.sum())} key(s).")
+    return {"keys": pd.Index(k[first].array), "attrs": R.loc[first, add_cols].reset_index(drop=True),
+            "labels": (R.loc[first, right_key] if right_key in R.columns else k[first]).astype("string").reset_index(drop=True),
+            "label": label}
+
+def mapping_lookup(path: str, sheet=0, *, right_key: str, add_cols: list[str] | None,
+    cleanse: bool = True, title_case: bool = True, remove_punct: bool = True) -> dict:
+    entry = _registry_entry(path, sheet, cleanse=cleanse, title_case=title_case, remove_punct=remove_punct)
+    lkey = (right_key, tuple(add_cols) if add_cols is not None else None)
+    with _REGISTRY_LOCK:
+        if lkey not in entry["lookups"]:
+            entry["lookups"][lkey] = _build_lookup(entry["table"], right_key, add_cols, label=f"{Path(path).name}")
+        return entry["lookups"][lkey]
+
+def _find_replace_append(out: pd.DataFrame, lookup: dict, *, left_key: str) -> np.ndarray:
+    # In place: append the lookup's attribute columns for out[left_key]; keys are normalised once per distinct value.
+    # Returns the matched table row per trial (-1 = unmapped).
+    lk = out[left_key] if left_key in out.columns else pd.Series("", index=out.index, dtype="string")
+    codes, uniques = pd.factorize(lk, use_na_sentinel=False)
+    row = lookup["keys"].get_indexer(_norm_key(pd.Series(uniques)))[codes]
+    attrs = lookup["attrs"].reindex(row).set_axis(out.index)   # -1 -> no match (NaN)
+    for c in attrs.columns:
+        out[c] = attrs[c]
+    return row
+
+def _fuzzy_index(lookup: dict) -> dict:
+    with _REGISTRY_LOCK:
+        if "fuzzy_index" not in lookup:
+            lookup["fuzzy_index"] = build_trigram_index(lookup["keys"].fillna("").tolist())
+        return lookup["fuzzy_index"]
+
+def _fuzzy_memo(lookup: dict, threshold: float) -> dict:
+    # fuzzy results per threshold, kept with the lookup (rebuilt with it when the mapping file changes)
+    with _REGISTRY_LOCK:
+        return lookup.setdefault("fuzzy_memo", {}).setdefault(threshold, {})
+
+def _fuzzy_fill(out: pd.DataFrame, lookup: dict, row: np.ndarray, *, left_key: str, threshold: float,
+    cache_dir: str | None) -> None:
+    # Rows left unmapped by the exact lookup take the closest table key's attributes (Dice >= threshold) and are
+    # flagged with the matched key and its score; exact matches and misses leave both columns empty.
+    out["Bain_Fuzzy Match"] = pd.Series(pd.NA, index=out.index, dtype="string")
+    out["Bain_Fuzzy Score"] = np.nan
+    miss = np.flatnonzero(row < 0)
+    if not len(miss) or left_key not in out.columns:
+        return
+
+    codes, uniques = pd.factorize(out[left_key].iloc[miss], use_na_sentinel=False)
+    queries = _norm_key(pd.Series(uniques)).fillna("").tolist()
+    pos, score = fuzzy_match(lookup["keys"].fillna("").tolist(), queries, threshold=threshold,
+        index=_fuzzy_index(lookup), cache_dir=cache_dir, label=lookup["label"], memo=_fuzzy_memo(lookup, threshold))
+
+    hit = pos[codes] >= 0
+    rows = miss[hit]
+    match = pos[codes][hit]
+    attrs = lookup["attrs"].iloc[match]
+    for c in attrs.columns:
+        out.loc[rows, c] = attrs[c].to_numpy()
+    out.loc[rows, "Bain_Fuzzy Match"] = lookup["labels"].iloc[match].to_numpy()
+    out.loc[rows, "Bain_Fuzzy Score"] = score[codes][hit].round(3)
+
+def _fill_others(out: pd.DataFrame, col: str) -> None:
+    mask = out[col].astype("string").fillna("").eq("").to_numpy()
+    if mask.any():
+        out.loc[mask, col] = "Others"
 
 def map_revenue(union_with_lead: pd.DataFrame, *, 
     # mapping 1: Bain_Lead Sponsor -> EP Standard Name
@@ -83,48 +166,36 @@ def map_revenue(union_with_lead: pd.DataFrame, *,
     # cleaning toggles (set remove_punct/title_case to mirror Alteryx checkboxes)
     cleanse_inputs: bool = True, remove_punct: bool = True, title_case: bool = True,
 
+    # optional fuzzy fallback for sponsors mapping 1 can't find exactly (adds Bain_Fuzzy Match / Bain_Fuzzy Score)
+    fuzzy: bool = False, fuzzy_threshold: float = 0.85, fuzzy_cache_dir: str | None = None,
+
     # optional save
     output_path: str | None = None,) -> pd.DataFrame:
     """
     union_with_lead
-      -> F&R with mapping 1 (append EP Standard Name)
+      -> F&R with mapping 1 (append EP Standard Name; optional fuzzy fallback)
       -> F&R with EP 2023 US (append US segmentation; fillna='Others')
       -> F&R with EP 2024 WW (append WW segmentation; fillna='Others')
     """
-    # 1) read mapping tables
-    map1  = _read_mapping(map1_path,  map1_sheet)
-    map_us = _read_mapping(map_us_path, map_us_sheet)
-    map_ww = _read_mapping(map_ww_path, map_ww_sheet)
-
-    # 2) clean mapping inputs using your utilities (no row/col drops)
-    if cleanse_inputs:
-        # You can restrict columns; here we keep it simple and clean all string cols (pass None)
-        map1  = _clean_for_mapping(map1,  fields_to_clean=None, title_case=title_case, remove_punct=remove_punct)
-        map_us = _clean_for_mapping(map_us, fields_to_clean=None, title_case=title_case, remove_punct=remove_punct)
-        map_ww = _clean_for_mapping(map_ww, fields_to_clean=None, title_case=title_case, remove_punct=remove_punct)
-
-    # 3) Find & Replace #1: append EP Standard Name using Bain_Lead Sponsor
-    s1 = _find_replace_append(union_with_lead, map1, left_key=map1_left_col, right_key=map1_right_key, add_cols=map1_add_cols)
-
-    # 4) Find & Replace #2: append US segmentation on EP Standard Name
-    s2 = _find_replace_append(s1, map_us, left_key=map_us_key, right_key=map_us_key, add_cols=map_us_add_cols)
+    # 1) + 2) mapping tables from the registry (read + cleaned once per file version; no row/col drops)
+    flags = dict(cleanse=cleanse_inputs, title_case=title_case, remove_punct=remove_punct)
+    map1   = mapping_lookup(map1_path,  map1_sheet,  right_key=map1_right_key, add_cols=map1_add_cols, **flags)
+    map_us = mapping_lookup(map_us_path, map_us_sheet, right_key=map_us_key, add_cols=map_us_add_cols, **flags)
+    map_ww = mapping_lookup(map_ww_path, map_ww_sheet, right_key=map_ww_key, add_cols=map_ww_add_cols, **flags)
+
+    # 3)-5) one pass: Bain_Lead Sponsor -> EP Standard Name -> US / WW segmentation ("Others" when unmapped)
+    out = union_with_lead.reset_index(drop=True)
+    row = _find_replace_append(out, map1, left_key=map1_left_col)
+    if fuzzy:
+        _fuzzy_fill(out, map1, row, left_key=map1_left_col, threshold=fuzzy_threshold, cache_dir=fuzzy_cache_dir)
+    _find_replace_append(out, map_us, left_key=map_us_key)
     if map_us_add_cols:
-        col = map_us_add_cols[0]
-        mask = s2[col].astype("string").fillna("").eq("")
-        t = s2.loc[mask].copy(); t[col] = "Others"       
-        f = s2.loc[~mask]                                
-        s2 = pd.concat([f, t]).sort_index(kind="stable")
-
-    # 5) Find & Replace #3: append WW segmentation on EP Standard Name
-    s3 = _find_replace_append(s2, map_ww, left_key=map_ww_key, right_key=map_ww_key, add_cols=map_ww_add_cols)
+        _fill_others(out, map_us_add_cols[0])
+    _find_replace_append(out, map_ww, left_key=map_ww_key)
     if map_ww_add_cols:
-        col = map_ww_add_cols[0]
-        mask = s3[col].astype("string").fillna("").eq("")
-        t = s3.loc[mask].copy(); t[col] = "Others"
-        f = s3.loc[~mask]
-        s3 = pd.concat([f, t]).sort_index(kind="stable")
+        _fill_others(out, map_ww_add_cols[0])
 
     if output_path:
-        save_df(s3, output_path, index=False)
+        save_df(out, output_path, index=False)
 
-    return s3
+    return out
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import hashlib
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import pandas as pd
+
+# Bump when the on-disk layout changes so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 2
+_HASH_BLOCK = 1 << 20
+# Schema metadata listing the string[pyarrow] columns, which pandas' own metadata records as plain "string"
+_ARROW_STRINGS_KEY = b"trial_sights.arrow_strings"
+
+
+# Source fingerprint: path, size, mtime and a content hash
+def file_fingerprint(path: str | Path, known: dict | None = None) -> dict:
+    p = Path(path).resolve()
+    st = p.stat()
+    fp = {"path": str(p), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    # re-use the recorded hash while size/mtime are unchanged (avoids re-reading big files on every start)
+    if known and known.get("sha256") and all(known.get(k) == fp[k] for k in ("path", "size", "mtime_ns")):
+        fp["sha256"] = known["sha256"]
+        return fp
+
+    h = hashlib.sha256()
+    with p.open("rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    fp["sha256"] = h.hexdigest()
+    return fp
+
+
+# Settings version: hashes the source of modules/functions (where the cleaning constants live) and plain values
+def settings_fingerprint(*parts: Any) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        if inspect.ismodule(part) or inspect.isfunction(part):
+            try:
+                h.update(inspect.getsource(part).encode("utf-8"))
+                continue
+            except (OSError, TypeError):
+                pass
+        h.update(repr(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def snapshot_key(fingerprints: Iterable[dict], settings: str) -> str:
+    payload = json.dumps({"format": SNAPSHOT_FORMAT, "sources": list(fingerprints), "settings": settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _to_table(df: pd.DataFrame):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    arrow_strings = [c for c in df.columns if isinstance(df[c].dtype, pd.StringDtype) and df[c].dtype.storage == "pyarrow"]
+    if arrow_strings and df.columns.is_unique and all(isinstance(c, str) for c in df.columns):
+        table = table.replace_schema_metadata({**table.schema.metadata, _ARROW_STRINGS_KEY: json.dumps(arrow_strings).encode()})
+    return table
+
+
+def _to_pandas(table) -> pd.DataFrame:
+    # string[pyarrow] columns are wrapped around the table's buffers instead of being converted to Python strings
+    names = json.loads((table.schema.metadata or {}).get(_ARROW_STRINGS_KEY, b"[]"))
+    df = table.drop_columns(names).to_pandas(split_blocks=True)
+    for c in sorted(names, key=table.column_names.index):
+        df.insert(table.column_names.index(c), c, pd.StringDtype("pyarrow").__from_arrow__(table.column(c)))
+    return df
+
+
+def _write_arrow(df: pd.DataFrame, path: Path) -> None:
+    import pyarrow as pa
+    table = _to_table(df)
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_arrow(path: Path) -> pd.DataFrame:
+    # Memory-mapped: fixed-width columns without nulls and string[pyarrow] columns stay views of the file's pages,
+    # which the OS shares between all processes reading the same file (object columns are materialised per process)
+    import pyarrow as pa
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return _to_pandas(table)
+
+
+def write_frame(df: pd.DataFrame, stem: Path, *, mmap: bool = False) -> Path:
+    # Parquet (or uncompressed Arrow IPC with mmap=True) first; pickle only if pyarrow is missing or a column can't be stored columnar
+    out = stem.with_name(f"{stem.name}.{'arrow' if mmap else 'parquet'}")
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+    try:
+        if mmap:
+            _write_arrow(df, tmp)
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(_to_table(df), tmp)
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        out = stem.with_name(f"{stem.name}.pkl")
+        tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+        print(f"[WARN] {'Arrow' if mmap else 'Parquet'} snapshot failed ({type(e).__name__}: {e})\n"
+              f"       Falling back to pickle: '{out.name}'.")
+        df.to_pickle(tmp)
+    os.replace(tmp, out)
+    return out
+
+
+def read_frame(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return _to_pandas(pq.read_table(path))
+    if path.suffix == ".arrow":
+        return _read_arrow(path)
+    return pd.read_pickle(path)
+
+
+def _pid_alive(pid: int) -> bool:
+    # POSIX only (os.kill on Windows would terminate the process); elsewhere the heartbeat decides
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _lock_is_stale(path: Path, stale: float) -> bool:
+    # the builder died (its pid is gone) or stopped refreshing the lock's mtime
+    if time.time() - path.stat().st_mtime > stale:
+        return True
+    pid = path.read_text(encoding="ascii", errors="ignore").strip()
+    return pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid))
+
+
+@contextmanager
+def build_lock(path: Path, *, timeout: float = 4 * 3600, stale: float = 300, poll: float = 0.5):
+    """
+    Host-wide exclusive lock (O_EXCL lock file) so only one worker process builds a snapshot; the others wait and
+    then read what it stored. The holder refreshes the file's mtime every stale/3 seconds; a lock whose pid is no
+    longer running, or that hasn't been refreshed for `stale` seconds, is left over from a crashed builder.
+    """
+    if stale >= timeout:
+        raise ValueError(f"stale ({stale}s) must be shorter than timeout ({timeout}s)")
+    t0 = time.monotonic()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if _lock_is_stale(path, stale):
+                    print(f"[WARN] Removing stale lock '{path}'")
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() - t0 > timeout:
+                raise TimeoutError(f"Waited {timeout:.0f}s for lock '{path}'")
+            time.sleep(poll)
+
+    stop = threading.Event()
+    def heartbeat():
+        while not stop.wait(stale / 3):
+            try:
+                os.utime(path)
+            except OSError:
+                return
+    beat = threading.Thread(target=heartbeat, name=f"lock-{path.name}", daemon=True)
+    beat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        beat.join()
+        path.unlink(missing_ok=True)
+
+
+def _load_current(name: str, cache: Path, manifest: dict, key: str) -> pd.DataFrame | None:
+    if manifest.get("key") != key or not manifest.get("file"):
+        return None
+    data_path = cache / manifest["file"]
+    if not data_path.exists():
+        return None
+    try:
+        df = read_frame(data_path)
+    except Exception as e:
+        print(f"[WARN] Couldn’t read snapshot '{data_path}': {e}\n"
+              f"       Rebuilding '{name}'.")
+        return None
+    df.attrs["snapshot_key"] = key
+    print(f"[Snapshot_Cache] Loaded '{name}' from {data_path.name} ({len(df):,} rows)")
+    return df
+
+
+def _remove_old_snapshots(name: str, cache: Path, keep: Path) -> None:
+    # Earlier snapshots of `name`, including ones a previous rebuild couldn't delete. A file another worker still
+    # has memory-mapped can't be deleted on Windows: it is left for the next rebuild.
+    pattern = re.compile(rf"{re.escape(name)}-[0-9a-f]{{16}}\.(arrow|parquet|pkl)")
+    for old in cache.iterdir():
+        if old.name == keep.name or not pattern.fullmatch(old.name):
+            continue
+        try:
+            old.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[WARN] Couldn’t remove old snapshot '{old.name}' (still in use?): {e}\n"
+                  f"       It will be removed by the next rebuild.")
+
+
+def load_snapshot(
+    name: str,
+    builder: Callable[[], pd.DataFrame],
+    *,
+    sources: Iterable[str | Path],
+    settings: str,
+    cache_dir: str | Path,
+    mmap: bool = False) -> pd.DataFrame:
+    """
+    Return the cleaned frame for `name` from the on-disk cache, or run `builder()` and store it.
+    The cache is keyed by the source files' fingerprints plus `settings`; any change triggers a rebuild.
+    The key is exposed as df.attrs["snapshot_key"].
+    Rebuilds hold a host-wide lock, so concurrent worker processes build once and share the stored file;
+    with mmap=True it is stored as Arrow IPC and read memory-mapped.
+    """
+    cache = Path(cache_dir)
+    cache.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache / f"{name}.json"
+    manifest = read_manifest(manifest_path)
+
+    known = {fp.get("path"): fp for fp in manifest.get("sources", [])}
+    fingerprints = []
+    for s in sources:
+        resolved = str(Path(s).resolve())
+        fingerprints.append(file_fingerprint(resolved, known.get(resolved)))
+    key = snapshot_key(fingerprints, settings)
+
+    # 1) warm start
+    df = _load_current(name, cache, manifest, key)
+    if df is not None:
+        return df
+
+    with build_lock(cache / f"{name}.lock"):
+        # another process may have built it while we waited for the lock
+        manifest = read_manifest(manifest_path)
+        df = _load_current(name, cache, manifest, key)
+        if df is not None:
+            return df
+
+        # 2) cold start / stale: rebuild and store
+        df = builder()
+        data_path = write_frame(df, cache / f"{name}-{key[:16]}", mmap=mmap)
+        atomic_write_text(manifest_path, json.dumps({"key": key, "file": data_path.name, "sources": fingerprints}, indent=2))
+
+        _remove_old_snapshots(name, cache, keep=data_path)
+
+    df.attrs["snapshot_key"] = key
+    print(f"[Snapshot_Cache] Rebuilt '{name}' -> {data_path.name} ({len(df):,} rows)")
+    return df
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import threading
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from Utils import frame_memo
+from Bitmap_Index import MISSING, dimension_labels, filter_values
+from filtering import date_index
+
+# Summary dimensions of the results page; the study design / lead sponsor type dimensions are the /run selections
+CUBE_DIMENSIONS = ["phase", "region", "therapeutic_area", "us_segment", "ww_segment", "study_design", "lead_sponsor_type",
+                   "start_year", "start_month"]
+MEASURE = "trials"
+
+
+def _start_labels(df: pd.DataFrame) -> dict[str, pd.Series]:
+    # Start Date year/month (UTC, like apply_filters) as ints; rows without a date get MISSING
+    start = pd.Series(date_index(df)["start"])
+    return {"start_year": start.dt.year.astype("Int64").astype(object).where(start.notna(), MISSING),
+            "start_month": start.dt.month.astype("Int64").astype(object).where(start.notna(), MISSING)}
+
+
+class SummaryCube:
+    """
+    Row counts of a frame pre-aggregated over CUBE_DIMENSIONS: one cell per populated combination of labels.
+    Summaries are answered from the cells instead of the rows:
+      - slice: keep the cells whose labels are in the requested values (OR within a dimension, AND across)
+      - rollup: sum the measure over the dimensions not asked for
+    Unfiltered rollups are kept and later rollups start from the smallest kept cube that still has the dimensions
+    they need (a year x phase summary is summed from year x phase x region, not from the base cells).
+    """
+
+    def __init__(self, df: pd.DataFrame, dims: Iterable[str] = CUBE_DIMENSIONS):
+        self.dims = list(dims)
+        self.total = len(df)
+        start = _start_labels(df) if {"start_year", "start_month"} & set(self.dims) else {}
+        labels = pd.DataFrame({d: (start[d] if d in start else dimension_labels(df, d)).astype("category") for d in self.dims})
+        self.cells = labels.groupby(self.dims, sort=False, observed=True).size().rename(MEASURE).reset_index()
+        self._lock = threading.Lock()
+        self._rollups: dict[frozenset, pd.DataFrame] = {frozenset(self.dims): self.cells}
+        self._known = {d: self.cells[d].cat.categories.astype(str).tolist() for d in self.dims}
+        print(f"[Summary_Cube] {self.total:,} rows -> {len(self.cells):,} cells over {len(self.dims)} dimensions")
+
+    def _cube(self, dims: frozenset) -> pd.DataFrame:
+        # unfiltered rollup over `dims`, summed from the smallest kept cube that has them all, then kept
+        with self._lock:
+            hit = self._rollups.get(dims)
+            if hit is None:
+                src = min((cube for kept, cube in self._rollups.items() if dims <= kept), key=len)
+        if hit is not None:
+            return hit
+        out = src.groupby(sorted(dims), sort=False, observed=True)[MEASURE].sum().reset_index()
+        with self._lock:
+            return self._rollups.setdefault(dims, out)
+
+    def rollup(self, by: str | Iterable[str] = (), filters: dict[str, Iterable] | None = None) -> pd.DataFrame:
+        # `by` columns + MEASURE, largest first; `by` and each filter take one value or a list, filter values match
+        # labels by their text (2019 == "2019"). ValueError for malformed arguments, KeyError for unknown dimensions/values
+        by = [by] if isinstance(by, str) else by
+        if not isinstance(by, (list, tuple)) or not all(isinstance(d, str) for d in by):
+            raise ValueError(f"by must be a dimension or a list of dimensions, got {by!r}")
+        if not isinstance(filters, (dict, type(None))):
+            raise ValueError(f"filters must map dimensions to values, got {filters!r}")
+        by = list(by)
+        unknown = [d for d in [*by, *(filters or {})] if d not in self.dims]
+        if unknown:
+            raise KeyError(f"Unknown summary dimension: {unknown[0]!r} (known: {', '.join(self.dims)})")
+        filters = {d: filter_values(d, v, self._known[d]) for d, v in (filters or {}).items()}
+        filters = {d: v for d, v in filters.items() if v}
+        if not by and not filters:
+            return pd.DataFrame({MEASURE: [self.total]})
+
+        cube = self._cube(frozenset(by) | frozenset(filters))
+        if filters:
+            keep = np.ones(len(cube), dtype=bool)
+            for d, values in filters.items():
+                col = cube[d]
+                wanted = np.flatnonzero(col.cat.categories.astype(str).isin(values))
+                keep &= np.isin(col.cat.codes.to_numpy(), wanted)
+            cube = cube[keep]
+        if not by:
+            return pd.DataFrame({MEASURE: [int(cube[MEASURE].sum())]})
+        if len(by) < cube.shape[1] - 1:
+            cube = cube.groupby(by, sort=False, observed=True)[MEASURE].sum().reset_index()
+        return cube[by + [MEASURE]].sort_values(MEASURE, ascending=False, kind="stable").reset_index(drop=True)
+
+    def values(self) -> dict[str, list]:
+        return {d: sorted(self.cells[d].cat.categories.tolist(), key=str) for d in self.dims}
+
+
+def summary_cube(df: pd.DataFrame) -> SummaryCube:
+    # one cube per union snapshot (frame_memo: rebuilt only when the frame is)
+    return frame_memo(df, "summary_cube", SummaryCube)
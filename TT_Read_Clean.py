@@ -1,90 +1,184 @@
 from __future__ import annotations
+import importlib.util
+import sys
+from pathlib import Path
+import numpy as np
 import pandas as pd
 from typing import Literal
-from Utils import clean_selected_columns, to_datetime_cols, save_df
-
-
-def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None = None) -> pd.DataFrame:
-
-    # 1) KEEP / DROP (Select tool)
-    # Columns to keep from the Excel file (others are dropped)
-    COLS_TO_KEEP: list[str] = [
-        "Trial ID",  "Protocol/Trial ID", "Trial Title", "Trial Phase", "Trial Status",
-        "Therapeutic Area","Disease", "MeSH Term", "Sponsor/Collaborator", 
-        "Sponsor/Collaborator Type", "Sponsor/Collaborator: Parent HQ Country", 
-        "Primary Tested Drug", "Primary Tested Drug: Mechanism Of Action",
-        "Primary Tested Drug: Target", "Primary Tested Drug: Therapeutic Class", "Primary Tested Drug: Drug Type",
-        "Other Tested Drug", "Other Tested Drug: Mechanism Of Action",
-        "Other Tested Drug: Target", "Other Tested Drug: Therapeutic Class", "Other Tested Drug: Drug Type",
-        "Oncology Biomarker", "Oncology Biomarker Common Use(s)",
-        "Primary Endpoint", "Primary Endpoint Group",
-        "Primary Endpoint Details", "Secondary/Other Endpoint",
-        "Secondary/Other Endpoint Group", "Secondary/Other Endpoint Details",
-        "Start Date", "Treatment Duration (Mos.)", 
-        "Primary Completion Date", "Primary Completion Date Type", "Full Completion Date", "Primary Endpoints Reported Date",
-        "Primary Endpoints Reported Date Type", "Pts/Site/Mo", "Patient Gender", "Patient Age Group", "Min Patient Age", "Min Patient Age Unit",
-        "Max Patient Age", "Max Patient Age Unit", "Target Accrual", "Actual Accrual (No. of patients)", "Actual Accrual (% of Target)",
-        "Reported Sites", "Identified Sites", "Trial Region", "Countries", "Countries Count", "ClinicalTrials.gov Location Country", 
-        "ClinicalTrials.gov Sites Count", "Prior/Concurrent Therapy", "Treatment Plan", "Study Keywords", "Study Design",
-        "Decentralized (DCT) Attributes", "Associated CRO", "Last Modified Date"]
-
-    # 1.1) Renaming Cols
-    RENAMES = {
-        "Trial Status": "TT_Trial Status",
-        "Protocol/Trial ID": "Protocol_Trial_ID",
-        "Sponsor/Collaborator": "TT_Sponsor/Collaborator",
-        "Primary Tested Drug: Target": "Primary Tested Drug: Target_truncated",
-        "Other Tested Drug: Mechanism Of Action":"Other Tested Drug: Mechanism Of Action_truncated",
-        "Other Tested Drug: Target": "Other Tested Drug: Target_truncated",
-        "Other Tested Drug: Therapeutic Class": "Other Tested Drug: Therapeutic Class_truncated",
-        "Primary Endpoint Group":"Primary Endpoint Group_truncated",
-        "Primary Endpoint Details":"Primary Endpoint Details_truncated",
-        "Secondary/Other Endpoint Group":"Secondary/Other Endpoint Group_truncated", 
-        "Secondary/Other Endpoint Details":"Secondary/Other Endpoint Details_truncated",
-        "Prior/Concurrent Therapy":"Prior/Concurrent Therapy_truncated",
-        "Study Design":"TT_Study Design"}
-
-
-    # 2) DATA CLEANING
-    REMOVE_NULL_ROWS  = True   # drop rows where ALL selected columns are null
-    REMOVE_NULL_COLS  = True   # drop columns that are entirely null
-
-    # Choosing fields to be cleaned.
-    # If empty, all present columns will be cleaned
-    FIELDS_TO_CLEANSE: list[str] = [
-        "Trial ID", "Protocol_Trial_ID", "Trial Title", "Trial Phase", 
-        "Therapeutic Area","Disease", "Primary Tested Drug", "Primary Tested Drug: Mechanism Of Action",
-        "Primary Tested Drug: Target_truncated", "Primary Tested Drug: Therapeutic Class",
-        "Other Tested Drug", "Other Tested Drug: Mechanism Of Action_truncated",
-        "Other Tested Drug: Target_truncated", "Other Tested Drug: Therapeutic Class_truncated",
-        "Oncology Biomarker", "Oncology Biomarker Common Use(s)",
-        "Primary Endpoint", "Primary Endpoint Group_truncated",
-        "Primary Endpoint Details_truncated", "Secondary/Other Endpoint",
-        "Secondary/Other Endpoint Group_truncated", "Secondary/Other Endpoint Details_truncated",
-        "Start Date", "Primary Completion Date", "Primary Completion Date Type", "Primary Endpoints Reported Date",
-        "Primary Endpoints Reported Date Type", "Patient Gender", "Patient Age Group", "Min Patient Age", "Min Patient Age Unit",
-        "Max Patient Age", "Max Patient Age Unit", "Target Accrual", "Actual Accrual (No. of patients)", "Actual Accrual (% of Target)",
-        "Reported Sites", "Identified Sites", "Trial Region", "Countries", "ClinicalTrials.gov Location Country", 
-        "ClinicalTrials.gov Sites Count", "Prior/Concurrent Therapy_truncated", "Study Keywords", "Associated CRO", "Last Modified Date"]
-
-    # Replace nulls
-    REPLACE_NULLS_STRINGS = True
-    REPLACE_NULLS_NUMBERS = True
-
-    # Remove unwanted characters
-    REMOVE_LEADING_TRAILING_WHITESPACE       = True
-    REPLACE_TABS_LB_DUP_WHITESPACE_WITH_SPACE = True  # tabs, line breaks, duplicate whitespace will become a single space
-
-    # Modify case: one of {"none","upper","lower","title"}
-    MODIFY_CASE: Literal["none","upper","lower","title"] = "title"
+import Utils
+from Utils import (clean_selected_columns, to_datetime_cols, save_df, text_cleaning_pool, print_clean_timings,
+    apply_schema, memory_report)
+from Snapshot_Cache import load_snapshot, settings_fingerprint
+from Delta_Ingest import incremental_clean
 
+TTReaderEngine = Literal["openpyxl", "stream", "calamine", "auto"]
+_EXCEL_ERROR_CODES = frozenset(["#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A", "#GETTING_DATA"])
 
-    # 3) CREATING DATAFRAME WITH APPROPRIATE RENAMES AND TYPES
-    TT_initial = pd.read_excel(excel_path, sheet_name=sheet)
 
-    # Select only requested columns that actually exist
-    keep = [c for c in COLS_TO_KEEP if c in TT_initial.columns]
-    TT_initial = TT_initial[keep].copy()
+# Columns to keep from the TrialTrove sheet (others are never read by the stream/calamine engines)
+TT_COLS_TO_KEEP: list[str] = [
+    "Trial ID",  "Protocol/Trial ID", "Trial Title", "Trial Phase", "Trial Status",
+    "Therapeutic Area","Disease", "MeSH Term", "Sponsor/Collaborator", 
+    "Sponsor/Collaborator Type", "Sponsor/Collaborator: Parent HQ Country", 
+    "Primary Tested Drug", "Primary Tested Drug: Mechanism Of Action",
+    "Primary Tested Drug: Target", "Primary Tested Drug: Therapeutic Class", "Primary Tested Drug: Drug Type",
+    "Other Tested Drug", "Other Tested Drug: Mechanism Of Action",
+    "Other Tested Drug: Target", "Other Tested Drug: Therapeutic Class", "Other Tested Drug: Drug Type",
+    "Oncology Biomarker", "Oncology Biomarker Common Use(s)",
+    "Primary Endpoint", "Primary Endpoint Group",
+    "Primary Endpoint Details", "Secondary/Other Endpoint",
+    "Secondary/Other Endpoint Group", "Secondary/Other Endpoint Details",
+    "Start Date", "Treatment Duration (Mos.)", 
+    "Primary Completion Date", "Primary Completion Date Type", "Full Completion Date", "Primary Endpoints Reported Date",
+    "Primary Endpoints Reported Date Type", "Pts/Site/Mo", "Patient Gender", "Patient Age Group", "Min Patient Age", "Min Patient Age Unit",
+    "Max Patient Age", "Max Patient Age Unit", "Target Accrual", "Actual Accrual (No. of patients)", "Actual Accrual (% of Target)",
+    "Reported Sites", "Identified Sites", "Trial Region", "Countries", "Countries Count", "ClinicalTrials.gov Location Country", 
+    "ClinicalTrials.gov Sites Count", "Prior/Concurrent Therapy", "Treatment Plan", "Study Keywords", "Study Design",
+    "Decentralized (DCT) Attributes", "Associated CRO", "Last Modified Date"]
+
+
+def _convert_tt_value(v):
+    # Same conversion pandas applies to openpyxl cells (values_only rows: error cells arrive as their code, e.g. "#N/A")
+    if v is None:
+        return ""
+    if isinstance(v, str):
+        return np.nan if v in _EXCEL_ERROR_CODES else v
+    if isinstance(v, float):
+        i = int(v)
+        return i if i == v else v
+    return v
+
+
+def _read_tt_sheet_streaming(excel_path: str, sheet: str | int, columns: list[str]) -> pd.DataFrame:
+    # Read-only worksheet iterator; only the kept columns are converted and handed to pandas' TextParser
+    from openpyxl import load_workbook
+    from pandas.io.parsers import TextParser
+
+    wb = load_workbook(excel_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[sheet] if isinstance(sheet, str) else wb.worksheets[sheet]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+
+        wanted = set(columns)
+        first_pos: dict = {}
+        for i, name in enumerate(header):
+            if name in wanted and name not in first_pos:
+                first_pos[name] = i
+        names = [c for c in columns if c in first_pos]
+        idx = [first_pos[c] for c in names]
+
+        data: list[list] = []
+        last_row_with_data = -1
+        for row in rows:
+            n = len(row)
+            data.append([_convert_tt_value(row[i]) if i < n else "" for i in idx])
+            if any(v is not None for v in row):   # pandas trims trailing empty rows of the whole sheet
+                last_row_with_data = len(data) - 1
+        data = data[: last_row_with_data + 1]
+    finally:
+        wb.close()
+
+    return TextParser([names, *data], header=0, skip_blank_lines=False).read()
+
+
+def _read_tt_sheet(excel_path: str, sheet: str | int, columns: list[str], engine: TTReaderEngine = "openpyxl") -> pd.DataFrame:
+    """
+    Read only `columns` (in that order) from the TrialTrove sheet.
+      openpyxl : pd.read_excel on the whole sheet, then select (original path)
+      stream   : read-only openpyxl iterator, converts only the kept cells
+      calamine : Rust reader via pandas (needs python-calamine)
+      auto     : calamine when installed, else stream
+    """
+    if engine == "auto":
+        engine = "calamine" if importlib.util.find_spec("python_calamine") else "stream"
+
+    if engine == "stream":
+        return _read_tt_sheet_streaming(excel_path, sheet, columns)
+
+    if engine == "calamine":
+        wanted = set(columns)
+        df = pd.read_excel(excel_path, sheet_name=sheet, engine="calamine", usecols=lambda c: c in wanted)
+    else:
+        df = pd.read_excel(excel_path, sheet_name=sheet)
+    return df[[c for c in columns if c in df.columns]].copy()
+
+
+# 1.1) Renaming Cols
+RENAMES = {
+    "Trial Status": "TT_Trial Status",
+    "Protocol/Trial ID": "Protocol_Trial_ID",
+    "Sponsor/Collaborator": "TT_Sponsor/Collaborator",
+    "Primary Tested Drug: Target": "Primary Tested Drug: Target_truncated",
+    "Other Tested Drug: Mechanism Of Action":"Other Tested Drug: Mechanism Of Action_truncated",
+    "Other Tested Drug: Target": "Other Tested Drug: Target_truncated",
+    "Other Tested Drug: Therapeutic Class": "Other Tested Drug: Therapeutic Class_truncated",
+    "Primary Endpoint Group":"Primary Endpoint Group_truncated",
+    "Primary Endpoint Details":"Primary Endpoint Details_truncated",
+    "Secondary/Other Endpoint Group":"Secondary/Other Endpoint Group_truncated", 
+    "Secondary/Other Endpoint Details":"Secondary/Other Endpoint Details_truncated",
+    "Prior/Concurrent Therapy":"Prior/Concurrent Therapy_truncated",
+    "Study Design":"TT_Study Design"}
+
+
+# 2) DATA CLEANING
+REMOVE_NULL_ROWS  = True   # drop rows where ALL selected columns are null
+REMOVE_NULL_COLS  = True   # drop columns that are entirely null
+
+# Choosing fields to be cleaned.
+# If empty, all present columns will be cleaned
+FIELDS_TO_CLEANSE: list[str] = [
+    "Trial ID", "Protocol_Trial_ID", "Trial Title", "Trial Phase", 
+    "Therapeutic Area","Disease", "Primary Tested Drug", "Primary Tested Drug: Mechanism Of Action",
+    "Primary Tested Drug: Target_truncated", "Primary Tested Drug: Therapeutic Class",
+    "Other Tested Drug", "Other Tested Drug: Mechanism Of Action_truncated",
+    "Other Tested Drug: Target_truncated", "Other Tested Drug: Therapeutic Class_truncated",
+    "Oncology Biomarker", "Oncology Biomarker Common Use(s)",
+    "Primary Endpoint", "Primary Endpoint Group_truncated",
+    "Primary Endpoint Details_truncated", "Secondary/Other Endpoint",
+    "Secondary/Other Endpoint Group_truncated", "Secondary/Other Endpoint Details_truncated",
+    "Start Date", "Primary Completion Date", "Primary Completion Date Type", "Primary Endpoints Reported Date",
+    "Primary Endpoints Reported Date Type", "Patient Gender", "Patient Age Group", "Min Patient Age", "Min Patient Age Unit",
+    "Max Patient Age", "Max Patient Age Unit", "Target Accrual", "Actual Accrual (No. of patients)", "Actual Accrual (% of Target)",
+    "Reported Sites", "Identified Sites", "Trial Region", "Countries", "ClinicalTrials.gov Location Country", 
+    "ClinicalTrials.gov Sites Count", "Prior/Concurrent Therapy_truncated", "Study Keywords", "Associated CRO", "Last Modified Date"]
+
+# Replace nulls
+REPLACE_NULLS_STRINGS = True
+REPLACE_NULLS_NUMBERS = True
+
+# Remove unwanted characters
+REMOVE_LEADING_TRAILING_WHITESPACE       = True
+REPLACE_TABS_LB_DUP_WHITESPACE_WITH_SPACE = True  # tabs, line breaks, duplicate whitespace will become a single space
+
+# Modify case: one of {"none","upper","lower","title"}
+MODIFY_CASE: Literal["none","upper","lower","title"] = "title"
+
+# Compact schema of the cleaned frame: free text as string[pyarrow], enumerations as categoricals,
+# counts as nullable Int64, derived age flags as nullable booleans
+COMPACT_DTYPES = True
+PRINT_MEMORY_REPORT = True   # per-column footprint before/after the compact schema
+TT_CATEGORY_COLS = [
+    "TT_Trial Status", "Therapeutic Area", "Trial Phase", "Patient Gender", "Patient Age Group",
+    "Sponsor/Collaborator Type", "Primary Completion Date Type", "Primary Endpoints Reported Date Type",
+    "Min Patient Age Unit", "Max Patient Age Unit"]
+TT_INT_COLS = ["Trial ID", "Target Accrual", "Reported Sites", "Countries Count"]
+TT_FLAG_COLS = ["child", "adult", "older_adults"]
+
+
+def read_tt_raw(excel_path: str, sheet: str = "Results", engine: TTReaderEngine = "openpyxl", sidecar: bool = False) -> pd.DataFrame:
+    # Kept columns, renamed and typed (dates, Trial ID); nothing is cleaned yet
+    # 3) CREATING DATAFRAME WITH APPROPRIATE RENAMES AND TYPES
+    # Only requested columns that actually exist are returned
+    COLS_TO_KEEP: list[str] = TT_COLS_TO_KEEP
+    if sidecar:
+        TT_initial = load_snapshot(f"{Path(excel_path).stem}.{sheet}",
+            lambda: _read_tt_sheet(excel_path, sheet, COLS_TO_KEEP, engine),
+            sources=[excel_path], settings=settings_fingerprint(_read_tt_sheet, _read_tt_sheet_streaming, _convert_tt_value, COLS_TO_KEEP, engine),
+            cache_dir=Path(excel_path).with_name(".tt_sidecar"))
+    else:
+        TT_initial = _read_tt_sheet(excel_path, sheet, COLS_TO_KEEP, engine)
 
     # Rename columns per your Select tool
     if RENAMES:
@@ -101,7 +195,11 @@ def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None
     # Change field type for "Trial ID" to Int64
     if "Trial ID" in TT_initial.columns:
         TT_initial["Trial ID"] = pd.to_numeric(TT_initial["Trial ID"], errors="coerce").astype("Int64")
+    return TT_initial
+
 
+def clean_tt_frame(TT_initial: pd.DataFrame, executor=None, timings: dict[str, float] | None = None) -> pd.DataFrame:
+    # Row-by-row part of the cleaning plus the derived columns; null-column drops are in finalize_tt_frame
     selected_cols = TT_initial.columns.tolist()
 
     TT_initial = clean_selected_columns(
@@ -113,7 +211,9 @@ def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None
         collapse_ws=REPLACE_TABS_LB_DUP_WHITESPACE_WITH_SPACE,
         case_mode=MODIFY_CASE,
         drop_rows=REMOVE_NULL_ROWS,
-        drop_cols=REMOVE_NULL_COLS)
+        drop_cols=False,
+        executor=executor,
+        timings=timings)
 
     final_cols = [c for c in selected_cols if c in TT_initial.columns]
     TT_initial = TT_initial[final_cols]
@@ -141,6 +241,43 @@ def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None
     
     final_cols = ([c for c in base_cols if c in TT_initial.columns]+ ["NCT ID", "child", "adult", "older_adults"])
     TT_initial = TT_initial[[c for c in final_cols if c in TT_initial.columns]]
+    return TT_initial
+
+
+def finalize_tt_frame(TT_initial: pd.DataFrame) -> pd.DataFrame:
+    # drop cleaned columns that are entirely null
+    if REMOVE_NULL_COLS:
+        TT_initial = TT_initial.drop(columns=[c for c in FIELDS_TO_CLEANSE if c in TT_initial.columns and TT_initial[c].isna().all()])
+    if COMPACT_DTYPES:
+        compact = apply_schema(TT_initial, category=TT_CATEGORY_COLS, integer=TT_INT_COLS, boolean=TT_FLAG_COLS)
+        if PRINT_MEMORY_REPORT:
+            memory_report("TT_Cleaning", TT_initial, compact)
+        TT_initial = compact
+    return TT_initial
+
+
+def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None = None,
+    engine: TTReaderEngine = "openpyxl", sidecar: bool = False, workers: int | None = None,
+    delta_dir: str | Path | None = None) -> pd.DataFrame:
+    # engine:    workbook reader (see _read_tt_sheet)
+    # sidecar:   convert the kept columns once into a columnar file next to the workbook; later runs read that
+    #            until the workbook changes
+    # workers:   >1 cleans the text columns on a process pool of this size and prints per-column timings
+    # delta_dir: keep the cleaned rows here and, on the next refresh, only clean trials that are new or changed
+    TT_initial = read_tt_raw(excel_path, sheet, engine, sidecar)
+
+    timings: dict[str, float] = {}
+    with text_cleaning_pool(workers) as pool:
+        clean = lambda part: clean_tt_frame(part, executor=pool, timings=timings)
+        if delta_dir:
+            TT_initial = incremental_clean("tt", TT_initial, key="Trial ID", clean=clean, state_dir=delta_dir,
+                settings=settings_fingerprint(sys.modules[__name__], Utils))
+        else:
+            TT_initial = clean(TT_initial)
+    if workers and workers > 1:
+        print_clean_timings("TT_Cleaning", timings)
+
+    TT_initial = finalize_tt_frame(TT_initial)
 
     # 6) OPTIONAL OUTPUT (for quick inspection)
     # Save a DataFrame to CSV / Excel / Parquet based on the file extension
@@ -150,7 +287,6 @@ def TT_Cleaning(excel_path: str, sheet: str = "Results", output_path: str | None
             save_df(TT_initial, output_path, index=False)
         except PermissionError as e:
             # common on Windows when Excel/OneDrive keeps the file open
-            from pathlib import Path
             alt = Path(output_path).with_suffix(".csv")
             TT_initial.to_csv(alt, index=False)
             print(f"[WARN] Couldn’t write Excel '{output_path}' "
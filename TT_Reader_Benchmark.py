@@ -0,0 +1,76 @@
+# Times the TrialTrove reader engines on one workbook and checks they return the same frame.
+#   py TT_Reader_Benchmark.py "path\to\TrialTrove.xlsx" --sheet Results --repeat 3
+#
+# Reference numbers (synthetic 10,000-row x 85-column sheet, 60 kept columns, Linux, pandas 2.3):
+#   engine     read (s)   vs openpyxl
+#   openpyxl     19.3        1.0x
+#   stream       15.5        1.2x
+#   calamine      2.2        8.9x
+#   sidecar       0.02      ~800x     (warm; the first run pays one read + write)
+from __future__ import annotations
+import argparse
+import importlib.util
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import pandas as pd
+from TT_Read_Clean import TT_COLS_TO_KEEP, _read_tt_sheet
+from Snapshot_Cache import load_snapshot
+
+
+def _best_of(fn, repeat: int) -> tuple[float, pd.DataFrame]:
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TrialTrove reader benchmark")
+    parser.add_argument("excel_path")
+    parser.add_argument("--sheet", default="Results")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    engines = ["openpyxl", "stream"]
+    if importlib.util.find_spec("python_calamine"):
+        engines.append("calamine")
+    else:
+        print("[INFO] python-calamine not installed; skipping the calamine engine")
+
+    results: dict[str, float] = {}
+    baseline = None
+    for engine in engines:
+        secs, df = _best_of(lambda: _read_tt_sheet(args.excel_path, args.sheet, TT_COLS_TO_KEEP, engine), args.repeat)
+        results[engine] = secs
+        if baseline is None:
+            baseline = df
+        else:
+            try:
+                pd.testing.assert_frame_equal(baseline, df)
+                same = "identical"
+            except AssertionError as e:
+                same = f"DIFFERS: {str(e).splitlines()[0]}"
+            print(f"[{engine}] {same}")
+
+    # warm sidecar read (the conversion itself is the first, untimed call)
+    tmp = Path(tempfile.mkdtemp(prefix="tt_sidecar_"))
+    try:
+        build = lambda: _read_tt_sheet(args.excel_path, args.sheet, TT_COLS_TO_KEEP, engines[-1])
+        load = lambda: load_snapshot("bench", build, sources=[args.excel_path], settings=engines[-1], cache_dir=tmp)
+        load()
+        results["sidecar"], _ = _best_of(load, args.repeat)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    base = results["openpyxl"]
+    print(f"{'engine':<10} {'read (s)':>9}   vs openpyxl")
+    for engine, secs in results.items():
+        print(f"{engine:<10} {secs:>9.2f}   {base / secs:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
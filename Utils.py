@@ -1,25 +1,132 @@
 from __future__ import annotations
+import re
+import time
+import weakref
+from contextlib import nullcontext
+from functools import lru_cache
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Literal, Iterable
+from typing import Any, Callable, Literal, Iterable
+import numpy as np
 import pandas as pd
 from pandas.api.types import (is_numeric_dtype, is_string_dtype, is_object_dtype,
     is_datetime64_any_dtype, is_bool_dtype)
 
+_RX_TABS_LB  = re.compile(r"[\t\r\n]+")   # tabs/linebreaks -> space
+_RX_MULTI_WS = re.compile(r"\s{2,}")       # collapse multiple spaces
+_RX_PUNCT    = re.compile(r"[^\w\s]")
+_CASE_FUNCS  = {"upper": str.upper, "lower": str.lower, "title": str.title}
+
+# Fused text rules for plain str values (same order/semantics as the pandas .str chain they replace)
+def _clean_values(values: list[str], strip_ws: bool, collapse_ws: bool, case_mode: str, remove_punct: bool = False) -> list[str]:
+    sub_lb, sub_ws, sub_punct = _RX_TABS_LB.sub, _RX_MULTI_WS.sub, _RX_PUNCT.sub
+    case = _CASE_FUNCS.get(case_mode)
+    out = []
+    for v in values:
+        if strip_ws:
+            v = v.strip()
+        if collapse_ws:
+            v = sub_ws(" ", sub_lb(" ", v))
+        if case is not None:
+            v = case(v)
+        if remove_punct:
+            v = sub_punct("", v)
+        out.append(v)
+    return out
+
+def _clean_values_timed(values: list[str], *args) -> tuple[list[str], float]:
+    t0 = time.perf_counter()
+    out = _clean_values(values, *args)
+    return out, time.perf_counter() - t0
+
+# Rows (distinct values) per task when a column is split across pool workers
+TEXT_BLOCK_SIZE = 50_000
+
+def _clean_factorized(factorized: dict[str, tuple[np.ndarray, list[str]]], args: tuple, executor: Executor | None,
+    timings: dict[str, float] | None) -> dict[str, list[str]]:
+    # Columns (and blocks of very large columns) are cleaned as independent tasks; results are re-assembled in
+    # submission order, so the output does not depend on worker scheduling. timings[col] = summed worker seconds.
+    cleaned: dict[str, list[str]] = {}
+    spent: dict[str, float] = {}
+    if executor is None:
+        for c, (_, uniques) in factorized.items():
+            cleaned[c], spent[c] = _clean_values_timed(uniques, *args)
+    else:
+        futures = {c: [executor.submit(_clean_values_timed, uniques[i:i + TEXT_BLOCK_SIZE], *args)
+                       for i in range(0, len(uniques), TEXT_BLOCK_SIZE)]
+                   for c, (_, uniques) in factorized.items()}
+        for c, blocks in futures.items():
+            cleaned[c], spent[c] = [], 0.0
+            for f in blocks:
+                values, secs = f.result()
+                cleaned[c].extend(values)
+                spent[c] += secs
+    if timings is not None:
+        for c, secs in spent.items():
+            timings[c] = timings.get(c, 0.0) + secs
+    return cleaned
+
+# Process pool for the text cleaning, used as `with text_cleaning_pool(n) as pool:` (workers <= 1 -> pool is None)
+def text_cleaning_pool(workers: int | None) -> ProcessPoolExecutor | nullcontext:
+    if not workers or workers <= 1:
+        return nullcontext(None)
+    return ProcessPoolExecutor(max_workers=workers)
+
+def print_clean_timings(label: str, timings: dict[str, float], top: int = 10) -> None:
+    total = sum(timings.values())
+    print(f"[{label}] text cleaning: {len(timings)} columns, {total:.2f}s worker time")
+    for c, secs in sorted(timings.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        print(f"    {secs:8.3f}s  {c}")
+
+# Split a string column into (codes, distinct values); rules then run once per distinct value
+def _factorize_text(s: pd.Series) -> tuple[np.ndarray, list[str]]:
+    codes, uniques = pd.factorize(s.astype("string"), use_na_sentinel=True)
+    return codes, list(uniques)
+
+def _from_codes(codes: np.ndarray, cleaned: list[str], like: pd.Series) -> pd.Series:
+    arr = pd.array(cleaned, dtype="string").take(codes, allow_fill=True)   # code -1 -> <NA>
+    return pd.Series(arr, index=like.index, name=like.name)
+
 # Text cleaning (Series)
-def clean_text_series(s: pd.Series, strip_ws: bool, collapse_ws: bool,case_mode: str) -> pd.Series:
-    s = s.astype("string")
-    if strip_ws:
-        s = s.str.strip()
-    if collapse_ws:
-        s = s.str.replace(r"[\t\r\n]+", " ", regex=True)  # tabs/linebreaks -> space
-        s = s.str.replace(r"\s{2,}", " ", regex=True)    # collapse multiple spaces
-    if case_mode == "upper":
-        s = s.str.upper()
-    elif case_mode == "lower":
-        s = s.str.lower()
-    elif case_mode == "title":
-        s = s.str.title()
-    return s
+def clean_text_series(s: pd.Series, strip_ws: bool, collapse_ws: bool,case_mode: str, remove_punct: bool = False) -> pd.Series:
+    if not (strip_ws or collapse_ws or case_mode in _CASE_FUNCS or remove_punct):
+        return s.astype("string")
+    codes, uniques = _factorize_text(s)
+    return _from_codes(codes, _clean_values(uniques, strip_ws, collapse_ws, case_mode, remove_punct), s)
+
+
+# Value-level normalisers with a bounded memo shared by every stage and request (sponsor names repeat heavily)
+NORMALIZE_MEMO_SIZE = 1 << 16
+_RX_LINE_BREAKS = re.compile(r"[\r\n]+")
+
+@lru_cache(maxsize=NORMALIZE_MEMO_SIZE)
+def sponsor_head(text: str) -> str:
+    # first line, text before the first comma, trimmed, Title Case
+    return _RX_LINE_BREAKS.split(text, 1)[0].split(",", 1)[0].strip().title()
+
+@lru_cache(maxsize=NORMALIZE_MEMO_SIZE)
+def norm_key_value(text: str, remove_punct: bool = True) -> str:
+    # mapping key: trimmed, single-spaced, lower case, optionally without punctuation
+    return _clean_values([text], True, True, "lower", remove_punct)[0]
+
+def map_distinct(s: pd.Series, fn: Callable[[str], str], dtype: Literal["object", "string"] = "object") -> pd.Series:
+    # fn runs once per distinct non-null value and is mapped back through the factorize codes; nulls stay <NA>
+    codes, uniques = pd.factorize(s)
+    values = [fn(v) for v in uniques]
+    if dtype == "string":
+        return _from_codes(codes, values, s)
+    out = np.empty(len(values) + 1, dtype=object)
+    out[:-1] = values
+    out[-1] = pd.NA                       # code -1
+    return pd.Series(out[codes], index=s.index, name=s.name)
+
+
+def _is_empty(col: pd.Series) -> np.ndarray:
+    if is_numeric_dtype(col) or is_bool_dtype(col) or is_datetime64_any_dtype(col):
+        return col.isna().to_numpy()                      # 0 is NOT empty
+    if isinstance(col.dtype, pd.StringDtype):
+        return col.isna().to_numpy() | (col.to_numpy(dtype=object, na_value="") == "")
+    return col.astype("string").str.len().fillna(0).eq(0).to_numpy()
 
 
 # DataFrame cleaning (select columns, fill nulls, text rules, drop all-empty rows/cols)
@@ -32,7 +139,13 @@ def clean_selected_columns(
     collapse_ws: bool,
     case_mode: Literal["none","upper","lower","title"],
     drop_rows: bool | None = None,
-    drop_cols: bool | None = None) -> pd.DataFrame:
+    drop_cols: bool | None = None,
+    remove_punct: bool = False,
+    executor: Executor | None = None,
+    timings: dict[str, float] | None = None) -> pd.DataFrame:
+    # remove_punct: also strip punctuation from the text columns in the same pass
+    # executor:     optional thread/process pool (see text_cleaning_pool); columns are sharded into tasks
+    # timings:      seconds spent cleaning each text column are added here
     out = df.copy()
 
     drop_rows = True if drop_rows is None else drop_rows
@@ -50,22 +163,23 @@ def clean_selected_columns(
     if replace_nulls_numbers and num_cols:
         out[num_cols] = out[num_cols].fillna(0)
 
-    if replace_nulls_strings and txt_cols:
-        for c in txt_cols:
-            out[c] = out[c].astype("string").fillna("")
-
-    # text cleanup (strings only, dates remain as is)
+    # text cleanup (strings only, dates remain as is): one fused pass over the distinct values of each column
+    factorized = {}
     for c in txt_cols:
-        out[c] = clean_text_series(out[c], strip_ws, collapse_ws, case_mode)
+        s = out[c].astype("string")
+        factorized[c] = _factorize_text(s.fillna("") if replace_nulls_strings else s)
+    cleaned = _clean_factorized(factorized, (strip_ws, collapse_ws, case_mode, remove_punct), executor, timings)
+    for c in txt_cols:
+        out[c] = _from_codes(factorized[c][0], cleaned[c], out[c])
 
-    # drop rows where all cols are empty/null
+    # drop rows where all cols are empty/null (column by column; stops as soon as no row can still be all-empty)
     if present and drop_rows:
-        def is_empty(col: pd.Series) -> pd.Series:
-            if is_numeric_dtype(col) or is_bool_dtype(col) or is_datetime64_any_dtype(col):
-                return col.isna()                         # 0 is NOT empty
-            return col.astype("string").str.len().fillna(0).eq(0)
-        null_like = out[present].apply(is_empty)
-        out = out[~null_like.all(axis=1)]
+        all_empty = np.ones(len(out), dtype=bool)
+        for c in present:
+            all_empty &= _is_empty(out[c])
+            if not all_empty.any():
+                break
+        out = out[~all_empty]
 
     # drop fully-null columns
     if drop_cols and present:
@@ -74,6 +188,74 @@ def clean_selected_columns(
 
     return out
 
+# Per-frame memo for structures derived from a loaded snapshot (join indexes, flags, ...). Entries are keyed by
+# frame identity and dropped with the frame; frames passed here are treated as read-only.
+_FRAME_MEMO: dict[tuple[int, Any], tuple[weakref.ref, Any]] = {}
+
+def frame_memo(df: pd.DataFrame, name: Any, build: Callable[[pd.DataFrame], Any]) -> Any:
+    k = (id(df), name)
+    hit = _FRAME_MEMO.get(k)
+    if hit is not None and hit[0]() is df:
+        return hit[1]
+    value = build(df)
+    _FRAME_MEMO[k] = (weakref.ref(df, lambda _, k=k: _FRAME_MEMO.pop(k, None)), value)
+    return value
+
+# Compact in-memory schema for cleaned frames
+def _integral(col: pd.Series) -> bool:
+    v = col.dropna().to_numpy(dtype=float)
+    return bool(np.all(np.isfinite(v)) and np.all(v == np.round(v)))
+
+@lru_cache(maxsize=1)
+def text_dtype() -> str:
+    # string[pyarrow] needs pyarrow; without it text columns keep Python-object storage
+    try:
+        import pyarrow  # noqa: F401
+        return "string[pyarrow]"
+    except ImportError:
+        print("[WARN] pyarrow is not installed; compact text columns use string[python]")
+        return "string[python]"
+
+def apply_schema(df: pd.DataFrame, *, category: Iterable[str] = (), boolean: Iterable[str] = (),
+    integer: Iterable[str] = ()) -> pd.DataFrame:
+    # category: enumerations; boolean: flags (nullable "boolean"); integer: counts stored as nullable Int64 (only if
+    # every value is whole); every other text column becomes string[pyarrow] (string[python] without pyarrow, see text_dtype)
+    # (object columns only if they hold nothing but str, so mixed columns keep their values as they are)
+    out = df.copy()
+    category, boolean, integer = set(category), set(boolean), set(integer)
+    text = text_dtype()
+    for c in out.columns:
+        col = out[c]
+        if c in category:
+            out[c] = col.astype("category")
+        elif c in boolean:
+            out[c] = col.astype("boolean")
+        elif c in integer and is_numeric_dtype(col) and not is_bool_dtype(col) and _integral(col):
+            out[c] = col.astype("Int64")   # full width: small nullable ints wrap on overflow in later arithmetic
+        elif (isinstance(col.dtype, pd.StringDtype) and col.dtype.storage == "python") or (
+                is_object_dtype(col) and pd.api.types.infer_dtype(col, skipna=True) in ("string", "empty")):
+            out[c] = col.astype(text)
+    return out
+
+def dtype_name(dtype) -> str:
+    # "string" for both storages otherwise
+    return f"string[{dtype.storage}]" if isinstance(dtype, pd.StringDtype) else str(dtype)
+
+def memory_report(label: str, before: pd.DataFrame, after: pd.DataFrame, top: int = 10) -> pd.DataFrame:
+    # per-column deep memory before/after a schema change, largest savings first
+    rep = pd.DataFrame({
+        "dtype_before": before.dtypes.map(dtype_name),
+        "bytes_before": before.memory_usage(index=False, deep=True),
+        "dtype_after": after.dtypes.reindex(before.columns).map(dtype_name),
+        "bytes_after": after.memory_usage(index=False, deep=True).reindex(before.columns)})
+    rep["saved"] = rep["bytes_before"] - rep["bytes_after"]
+    rep = rep.sort_values("saved", ascending=False)
+    b, a = rep["bytes_before"].sum(), rep["bytes_after"].sum()
+    print(f"[{label}] memory: {b / 2**20:,.1f} MiB -> {a / 2**20:,.1f} MiB ({len(before):,} rows, {len(rep)} columns)")
+    for c, r in rep.head(top).iterrows():
+        print(f"    {r['bytes_before'] / 2**20:8.2f} -> {r['bytes_after'] / 2**20:8.2f} MiB  {c} ({r['dtype_before']} -> {r['dtype_after']})")
+    return rep
+
 # Date conversion function
 def to_datetime_cols(df: pd.DataFrame, cols: Iterable[str]) -> pd.DataFrame:
     out = df.copy()
@@ -83,25 +265,19 @@ def to_datetime_cols(df: pd.DataFrame, cols: Iterable[str]) -> pd.DataFrame:
     return out
 
 # Punctuation removal for CT Gov
-def remove_punctuation_inplace(df: pd.DataFrame, columns: Iterable[str] | None = None) -> None:
+def remove_punctuation_inplace(df: pd.DataFrame, columns: Iterable[str] | None = None, executor: Executor | None = None,
+    timings: dict[str, float] | None = None) -> None:
     cols = list(columns) if columns else [
         c for c in df.columns
         if not is_numeric_dtype(df[c]) and not is_datetime64_any_dtype(df[c])
     ]
+    factorized = {c: _factorize_text(df[c]) for c in cols}
+    cleaned = _clean_factorized(factorized, (False, False, "none", True), executor, timings)
     for c in cols:
-        df[c] = df[c].astype("string").str.replace(r"[^\w\s]", "", regex=True)
+        df[c] = _from_codes(factorized[c][0], cleaned[c], df[c])
 
 # Save DataFrame by extension
 def save_df(df: pd.DataFrame, path: str | Path, index: bool = False) -> None:
-    outp = Path(path)
-    outp.parent.mkdir(parents=True, exist_ok=True)
-    ext = outp.suffix.lower()
-    writers = {
-        ".csv": df.to_csv,
-        ".xlsx": df.to_excel,
-        ".xls": df.to_excel,
-        ".parquet": df.to_parquet,
-    }
-    if ext not in writers:
-        raise ValueError(f"Unsupported extension: {ext} (use .csv, .xlsx, .xls, .parquet)")
-    writers[ext](outp, index=index)
+    # .xlsx is streamed (constant memory); .csv, .csv.gz, .parquet, .feather (and .xls) are also accepted
+    from Output_Writer import write_output   # Output_Writer imports Utils
+    write_output(df, path, index=index)
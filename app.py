@@ -1,6 +1,7 @@
 import argparse
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify
 from datetime import datetime, timedelta
+import threading
 import time
 import uuid
 from filtering import apply_filters
@@ -8,9 +9,26 @@ from functools import lru_cache
 import pandas as pd
 from TT_Read_Clean import TT_Cleaning
 from CT_GOV_Read_Clean import CT_GOV_Cleaning
-from Join_Union import run_join_operation
+from Join_Union import run_join_operation, required_ct_columns
 from Lead_Sponsor import add_lead_sponsor
 from Revenue_Mapping import map_revenue
+from pathlib import Path
+import Utils
+import TT_Read_Clean
+import CT_GOV_Read_Clean
+from Snapshot_Cache import load_snapshot, settings_fingerprint
+from Jobs import JobRunner, JobQueueFull
+from Result_Cache import ResultCache, result_key
+from Base_Pipeline import build_base, refine, save_outputs
+from Bitmap_Index import bitmap_index
+from Summary_Cube import summary_cube
+import Base_Pipeline
+import Join_Union
+import Lead_Sponsor
+import Revenue_Mapping
+import Fuzzy_Match
+import Output_Writer
+import filtering
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -32,13 +50,65 @@ app.config.update(
     REV_US_SHEET      = 0,
     REV_WW_PATH       = r"C:\Users\61272\OneDrive - Bain\Documents\Work\IP\TrialTrove Health Sector IP\Mapping table_EP 2024 global pharma vs. SMID WW.xlsx",
     REV_WW_SHEET      = 0,
-    REV_OUTPUT_PATH   = r"C:\Users\61272\OneDrive - Bain\Documents\Work\IP\TrialTrove Health Sector IP\Revenue Mapping using files.xlsx")
+    REV_OUTPUT_PATH   = r"C:\Users\61272\OneDrive - Bain\Documents\Work\IP\TrialTrove Health Sector IP\Revenue Mapping using files.xlsx",
+    SNAPSHOT_CACHE_DIR = str(Path(__file__).with_name(".snapshot_cache")),   # set to None to always re-clean from source
+    SNAPSHOT_MMAP     = True,     # store snapshots as Arrow IPC and memory-map them (worker processes share the file's pages)
+    CT_CSV_CHUNKSIZE  = 50_000,   # stream the CT.gov CSV in row blocks (bounded memory); None reads it in one go
+    CT_PROJECT_COLUMNS = True,    # only parse the CT columns the join needs (see Join_Union.required_ct_columns);
+                                  # CT_OUTPUT_PATH is then not written (it would hold only those columns)
+    TT_EXCEL_ENGINE   = "auto",   # "openpyxl" | "stream" | "calamine" | "auto" (calamine if installed, else stream)
+    TT_EXCEL_SIDECAR  = False,    # convert the workbook's kept columns once into a columnar file next to it
+    CLEAN_WORKERS     = None,     # >1: clean TT/CT text columns on a process pool of this many workers
+    DELTA_STATE_DIR   = str(Path(__file__).with_name(".delta_state")),   # keep cleaned rows between refreshes and only re-clean new/changed trials; None cleans everything
+    REV_FUZZY_MATCH   = False,    # fuzzy fallback for lead sponsors the EP name mapping misses (adds Bain_Fuzzy Match/Score)
+    REV_FUZZY_THRESHOLD = 0.85,   # minimum trigram Dice similarity for a fuzzy match
+    JOB_WORKERS       = 2,        # pipeline runs executed at the same time by the job API
+    JOB_MAX_PENDING   = 8,        # queued + running jobs accepted before /api/jobs answers 429
+    JOB_KEEP_FINISHED = 200,      # finished jobs (and results) kept for /api/jobs/<id>/result
+    RESULT_CACHE_MAX_MB = 1024,   # memory budget for cached /run results (least recently used evicted first)
+    RESULT_CACHE_DIR  = None,     # e.g. str(Path(__file__).with_name(".result_cache")) to also keep results on disk
+    RESULT_CACHE_DISK_ENTRIES = 64,   # results kept in RESULT_CACHE_DIR
+    OUTPUT_WORKERS    = 4,        # output files written at the same time (.xlsx streamed; .csv.gz/.parquet/.feather also accepted)
+    WARMUP_ON_START   = True,     # load data + base tables in the background at start (python app.py) or on the first /readyz probe
+    WARMUP_RETRY_SECONDS = 60)    # after a failed warm-up, /readyz starts another one once this long has passed
+
+_clean_data: tuple | None = None
+_clean_data_lock = threading.Lock()
 
-@lru_cache(maxsize=1)
 def load_clean_data() -> tuple:
-    #    Runs the cleaning once per process and caches the pair of DataFrames. In dev, the debug reloader creates a second process; each gets its own cache
-    tt_df = TT_Cleaning(excel_path=app.config['TT_EXCEL_PATH'], sheet=app.config['TT_EXCEL_SHEET'], output_path=app.config.get('TT_OUTPUT_PATH'))
-    ct_df = CT_GOV_Cleaning(csv_path=app.config['CT_CSV_PATH'], output_path=app.config.get('CT_OUTPUT_PATH'))
+    #    Loads the cleaned pair of DataFrames once per process; concurrent first requests wait for the same load (single flight)
+    global _clean_data
+    if _clean_data is None:
+        with _clean_data_lock:
+            if _clean_data is None:
+                _clean_data = _load_clean_data()
+    return _clean_data
+
+def _load_clean_data() -> tuple:
+    #    With SNAPSHOT_CACHE_DIR set, cleaned frames are also kept on disk and only rebuilt when the source file or cleaning code changes.
+    #    The rebuild holds a host-wide lock: one worker process cleans, the other workers load its snapshot (memory-mapped with SNAPSHOT_MMAP)
+    def build_tt():
+        return TT_Cleaning(excel_path=app.config['TT_EXCEL_PATH'], sheet=app.config['TT_EXCEL_SHEET'], output_path=app.config.get('TT_OUTPUT_PATH'),
+            engine=app.config.get('TT_EXCEL_ENGINE', "openpyxl"), sidecar=app.config.get('TT_EXCEL_SIDECAR', False),
+            workers=app.config.get('CLEAN_WORKERS'), delta_dir=app.config.get('DELTA_STATE_DIR'))
+
+    def build_ct():
+        return CT_GOV_Cleaning(csv_path=app.config['CT_CSV_PATH'], output_path=app.config.get('CT_OUTPUT_PATH'),
+            chunksize=app.config.get('CT_CSV_CHUNKSIZE'), columns=ct_columns, workers=app.config.get('CLEAN_WORKERS'),
+            delta_dir=app.config.get('DELTA_STATE_DIR'))
+
+    ct_columns = required_ct_columns() if app.config.get('CT_PROJECT_COLUMNS') else None
+
+    cache_dir = app.config.get('SNAPSHOT_CACHE_DIR')
+    if not cache_dir:
+        return build_tt(), build_ct()
+
+    tt_df = load_snapshot("tt_clean", build_tt, sources=[app.config['TT_EXCEL_PATH']],
+        settings=settings_fingerprint(TT_Read_Clean, Utils, app.config['TT_EXCEL_SHEET']), cache_dir=cache_dir,
+        mmap=app.config.get('SNAPSHOT_MMAP', False))
+    ct_df = load_snapshot("ct_clean", build_ct, sources=[app.config['CT_CSV_PATH']],
+        settings=settings_fingerprint(CT_GOV_Read_Clean, Utils, ct_columns), cache_dir=cache_dir,
+        mmap=app.config.get('SNAPSHOT_MMAP', False))
     return tt_df, ct_df
 
 # @app.route('/filters')
@@ -136,14 +206,104 @@ def _get_opt_bool(name: str):
     if s in ("0", "false", "f", "no", "off"):  return False
     return None
 
-@app.route("/run", methods=["GET"])
-def run_pipeline():
+# Stages reported by the job API, in order
+PIPELINE_STAGES = ["Loading cleaned data", "Building base tables", "Selecting rows", "Writing outputs"]
+RUN_FLAGS = ["interventional", "observational", "sponsor_industry", "sponsor_academic", "sponsor_others"]
+
+# Results of earlier runs, keyed by flags + data/code versions (see _result_key)
+results = ResultCache(max_bytes=int(app.config['RESULT_CACHE_MAX_MB'] * 2**20), disk_dir=app.config.get('RESULT_CACHE_DIR'),
+                      disk_entries=app.config['RESULT_CACHE_DISK_ENTRIES'])
+
+# Background runs for /api/jobs (bounded pool; extra submissions wait in its queue)
+jobs = JobRunner(PIPELINE_STAGES, workers=app.config['JOB_WORKERS'], max_pending=app.config['JOB_MAX_PENDING'],
+                 keep=app.config['JOB_KEEP_FINISHED'])
+
+def _run_flags() -> dict:
+    return {name: _get_opt_bool(name) for name in RUN_FLAGS}
+
+@lru_cache(maxsize=1)
+def _pipeline_settings() -> str:
+    # code of the pipeline stages (a change invalidates cached results)
+    return settings_fingerprint(Base_Pipeline, Join_Union, Lead_Sponsor, Revenue_Mapping, Fuzzy_Match, Output_Writer,
+                                filtering, Utils)
+
+def _result_key(tt_df: pd.DataFrame, ct_df: pd.DataFrame, flags: dict) -> tuple[str, bool]:
+    # flags + input snapshot versions + pipeline code + mapping tables; results are only persisted to disk when the
+    # inputs carry a snapshot key (without SNAPSHOT_CACHE_DIR the frames are only identified within this process)
+    snapshots = [df.attrs.get("snapshot_key") for df in (tt_df, ct_df)]
+    persist = all(snapshots)
+    if not persist:
+        snapshots = [f"process:{id(df)}" for df in (tt_df, ct_df)]
+    mappings = []
+    for name in ("REV_MAP1", "REV_US", "REV_WW"):
+        st = Path(app.config[f"{name}_PATH"]).stat()
+        mappings.append([app.config[f"{name}_PATH"], app.config.get(f"{name}_SHEET", 0), st.st_size, st.st_mtime_ns])
+    rev_options = [app.config.get(k) for k in ("REV_CLEANSE_INPUTS", "REV_REMOVE_PUNCT", "REV_TITLE_CASE",
+                                               "REV_FUZZY_MATCH", "REV_FUZZY_THRESHOLD")]
+    return result_key(flags, snapshots, _pipeline_settings(), mappings, rev_options), persist
+
+def _revenue_options() -> dict:
+    return dict(
+        map1_path=app.config["REV_MAP1_PATH"],
+        map1_sheet=app.config.get("REV_MAP1_SHEET", 0),
+        map_us_path=app.config["REV_US_PATH"],
+        map_us_sheet=app.config.get("REV_US_SHEET", 0),
+        map_ww_path=app.config["REV_WW_PATH"],
+        map_ww_sheet=app.config.get("REV_WW_SHEET", 0),
+        cleanse_inputs=app.config.get("REV_CLEANSE_INPUTS", True),
+        remove_punct=app.config.get("REV_REMOVE_PUNCT", True),
+        title_case=app.config.get("REV_TITLE_CASE", True),
+        fuzzy=app.config.get("REV_FUZZY_MATCH", False),
+        fuzzy_threshold=app.config.get("REV_FUZZY_THRESHOLD", 0.85),
+        fuzzy_cache_dir=app.config.get("SNAPSHOT_CACHE_DIR"))
+
+def _base_frames(tt_df: pd.DataFrame, ct_df: pd.DataFrame) -> dict:
+    # flag-independent join/tags/lead sponsor/revenue, built once per data snapshot (same cache, key without flags)
+    key, persist = _result_key(tt_df, ct_df, None)
+    base = results.get_or_compute(key, lambda: build_base(tt_df, ct_df, revenue=_revenue_options()), persist=persist)
+    _mark_ready()
+    return base
+
+def _run_pipeline(progress, flags: dict) -> dict:
+    # cleaned data -> base tables (once per snapshot) -> row selection for the flags; progress(stage) is called as each stage starts
+    # repeat runs (same flags, same data) are answered from the result cache; the output files are rewritten unless
+    # they still hold this run's frames
+    progress(PIPELINE_STAGES[0])
     tt_df, ct_df = load_clean_data()
-    study_interventional = _get_opt_bool("interventional")
-    study_observational  = _get_opt_bool("observational")
-    sponsor_industry  = _get_opt_bool("sponsor_industry")
-    sponsor_academic  = _get_opt_bool("sponsor_academic")
-    sponsor_others    = _get_opt_bool("sponsor_others")
+    key, persist = _result_key(tt_df, ct_df, flags)
+    frames = results.get_or_compute(key, lambda: _compute_run(progress, tt_df, ct_df, flags), persist=persist)
+    _write_outputs(progress, key, frames)
+    return _run_summary(tt_df, ct_df, frames, flags)
+
+# The output paths hold one run at a time: the result key last written by this process, with the files' mtimes then
+# (a file changed since, e.g. by another worker, is rewritten)
+_outputs_written: dict = {"key": None, "mtimes": None}
+_outputs_lock = threading.Lock()
+
+def _output_paths() -> dict:
+    return {"left": app.config.get("MERGE_LEFT_PATH"), "join": app.config.get("MERGE_JOIN_PATH"),
+            "union": app.config.get("MERGE_UNION_PATH"), "lead": app.config.get("LEAD_SPONSOR_PATH"),
+            "rev": app.config.get("REV_OUTPUT_PATH")}
+
+def _output_mtimes(paths: dict) -> dict:
+    return {name: (Path(p).stat().st_mtime_ns if Path(p).exists() else None) for name, p in paths.items() if p}
+
+def _write_outputs(progress, key: str, frames: dict) -> None:
+    paths = _output_paths()
+    with _outputs_lock:
+        if _outputs_written["key"] == key and _outputs_written["mtimes"] == _output_mtimes(paths):
+            return
+        progress(PIPELINE_STAGES[3])
+        _outputs_written["key"] = None
+        save_outputs(frames, paths, workers=app.config.get('OUTPUT_WORKERS', 4))
+        _outputs_written.update(key=key, mtimes=_output_mtimes(paths))
+
+def _compute_run(progress, tt_df: pd.DataFrame, ct_df: pd.DataFrame, flags: dict) -> dict:
+    study_interventional = flags.get("interventional")
+    study_observational  = flags.get("observational")
+    sponsor_industry  = flags.get("sponsor_industry")
+    sponsor_academic  = flags.get("sponsor_academic")
+    sponsor_others    = flags.get("sponsor_others")
     
     # Update basic fields
     # filters['start_date_from_month'] = int(request.form.get('start_date_from_month', 1))
@@ -176,18 +336,12 @@ def run_pipeline():
     # session['filters'] = filters
 
     # return redirect(url_for('filters'))
-    Left_only_TT_CT, Join_TT_CT, Union_TT_CT = run_join_operation(
-        tt_df,
-        ct_df,
-        right_cols_to_keep=None,  # use defaults in Join_Union; or pass a list to override
-        suffix_for_ct="_CT",
-        output_left_path=app.config.get("MERGE_LEFT_PATH"),
-        output_join_path=app.config.get("MERGE_JOIN_PATH"),
-        output_union_path=app.config.get("MERGE_UNION_PATH"),
-        debug=True, study_interventional=study_interventional, study_observational=study_observational,
-        sponsor_industry=sponsor_industry, sponsor_academic=sponsor_academic, sponsor_others=sponsor_others)
-
-    union_with_lead = add_lead_sponsor(Union_TT_CT, output_path=app.config.get("LEAD_SPONSOR_PATH"))
+    progress(PIPELINE_STAGES[1])
+    base = _base_frames(tt_df, ct_df)
+
+    progress(PIPELINE_STAGES[2])
+    frames = refine(base, study_interventional=study_interventional, study_observational=study_observational,
+                    sponsor_industry=sponsor_industry, sponsor_academic=sponsor_academic, sponsor_others=sponsor_others)
 
 # @app.route('/submit_request', methods=['POST'])
 # def submit_request():
@@ -249,22 +403,13 @@ def run_pipeline():
 #         step_index = min(len(steps) - 1, int((progress / 100) * len(steps)))
 #         step = steps[step_index]
     
-    rev_df = map_revenue(
-        union_with_lead,
-        map1_path=app.config["REV_MAP1_PATH"],
-        map1_sheet=app.config.get("REV_MAP1_SHEET", 0),
-        map_us_path=app.config["REV_US_PATH"],
-        map_us_sheet=app.config.get("REV_US_SHEET", 0),
-        map_ww_path=app.config["REV_WW_PATH"],
-        map_ww_sheet=app.config.get("REV_WW_SHEET", 0),
-        cleanse_inputs=app.config.get("REV_CLEANSE_INPUTS", True),
-        remove_punct=app.config.get("REV_REMOVE_PUNCT", True),
-        title_case=app.config.get("REV_TITLE_CASE", True),
-        output_path=app.config.get("REV_OUTPUT_PATH"),
-    )
+    return frames
 
+def _run_summary(tt_df: pd.DataFrame, ct_df: pd.DataFrame, frames: dict, flags: dict) -> dict:
+    Left_only_TT_CT, Join_TT_CT, Union_TT_CT = frames["left"], frames["join"], frames["union"]
+    union_with_lead, rev_df = frames["lead"], frames["rev"]
     # next steps: merge/map/apply filters; for now just return sizes
-    return jsonify({
+    return {
         "tt_rows": len(tt_df),
         "tt_cols": len(tt_df.columns),
         "ct_rows": len(ct_df),
@@ -283,11 +428,194 @@ def run_pipeline():
         "saved_join": bool(app.config.get("MERGE_JOIN_PATH")),
         "saved_union": bool(app.config.get("MERGE_UNION_PATH")),
         "saved_lead":  bool(app.config.get("LEAD_SPONSOR_PATH")),
-        "interventional": study_interventional,
-        "observational": study_observational,
-        "sponsor_industry": sponsor_industry,
-        "sponsor_academic": sponsor_academic,
-        "sponsor_others":   sponsor_others})
+        "interventional": flags.get("interventional"),
+        "observational": flags.get("observational"),
+        "sponsor_industry": flags.get("sponsor_industry"),
+        "sponsor_academic": flags.get("sponsor_academic"),
+        "sponsor_others":   flags.get("sponsor_others")}
+
+@app.route("/run", methods=["GET"])
+def run_pipeline():
+    # synchronous run (blocks this request until the pipeline is done)
+    return jsonify(_run_pipeline(lambda stage: None, _run_flags()))
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    # queue a pipeline run with the same flags as /run (query string, form or JSON); poll progress_url, then fetch result_url.
+    # POST only: a GET (prefetch, crawler) must not take a pipeline worker
+    try:
+        job_id = jobs.submit(_run_pipeline, _run_flags(), label="run")
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "30"}
+    return jsonify({"job_id": job_id,
+                    "progress_url": url_for("job_progress", job_id=job_id),
+                    "result_url": url_for("job_result", job_id=job_id)}), 202
+
+@app.route("/api/progress/<job_id>")
+def job_progress(job_id: str):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    # results.html reads status 'ready' as finished
+    if status["status"] == "done":
+        status.update(status="ready", step="Analysis complete!")
+    return jsonify(status)
+
+@app.route("/api/jobs/<job_id>/result")
+def job_result(job_id: str):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    if status["status"] == "failed":
+        return jsonify({"error": status["error"]}), 500
+    if status["status"] != "done":
+        return jsonify(status), 202
+    return jsonify(jobs.result(job_id))
+
+def _month_arg(value) -> tuple[int, int] | None:
+    # "2015-01" -> (2015, 1)
+    if not value:
+        return None
+    year, month = str(value).split("-")
+    if not 1 <= int(month) <= 12:
+        raise ValueError(f"month out of range: {value}")
+    return int(year), int(month)
+
+@app.route("/api/counts", methods=["GET", "POST"])
+def filter_counts():
+    # Row counts for a filter combination over the union snapshot, answered from its bitmap index.
+    # POST {"filters": {"phase": ["II", "III"], ...}, "start": "2015-01", "end": "2024-01", "facets": true}
+    # or GET ?phase=II&phase=III&start=2015-01; values are OR-ed within a dimension, dimensions AND-ed.
+    # The filters page's option values work too ("na", "Other", "CNS"); unknown dimensions or values are a 400.
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            return jsonify({"error": "body must be a JSON object"}), 400
+        filters = body.get("filters") or {}
+        start, end, facets = body.get("start"), body.get("end"), body.get("facets", True)
+    else:
+        args = request.args
+        filters = {k: args.getlist(k) for k in args if k not in ("start", "end", "facets")}
+        start, end, facets = args.get("start"), args.get("end"), args.get("facets", "1") not in ("0", "false")
+    try:
+        start, end = _month_arg(start), _month_arg(end)
+    except ValueError as e:
+        return jsonify({"error": f"start/end must be YYYY-MM ({e})"}), 400
+
+    tt_df, ct_df = load_clean_data()
+    index = bitmap_index(_base_frames(tt_df, ct_df)["rev"])
+    t0 = time.perf_counter()
+    try:
+        sel = index.select(filters, start=start, end=end)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": e.args[0], "dimensions": index.dimensions()}), 400
+    out = {"rows": index.count(sel), "total": index.n}
+    if facets:
+        out["facets"] = index.facets(sel)
+    out["ms"] = round(1000 * (time.perf_counter() - t0), 3)
+    return jsonify(out)
+
+@app.route("/api/summary", methods=["GET", "POST"])
+def summary():
+    # Trial counts by any of the cube dimensions (phase, region, therapeutic_area, us_segment, ww_segment, study_design,
+    # lead_sponsor_type, start_year, start_month), sliced by filters on them, from the pre-aggregated summary cube.
+    # POST {"by": ["start_year", "phase"], "filters": {"region": ["Global"], "start_year": [2020, 2021]}}
+    # or GET ?by=start_year&by=phase&region=Global; `by` and each filter take one value or a list, anything else is a 400
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            return jsonify({"error": "body must be a JSON object"}), 400
+        by, filters = body.get("by") or [], body.get("filters") or {}
+    else:
+        by = request.args.getlist("by")
+        filters = {k: request.args.getlist(k) for k in request.args if k != "by"}
+
+    tt_df, ct_df = load_clean_data()
+    cube = summary_cube(_base_frames(tt_df, ct_df)["rev"])
+    t0 = time.perf_counter()
+    try:
+        table = cube.rollup(by, filters)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": e.args[0], "dimensions": cube.values()}), 400
+    return jsonify({"by": by, "filters": filters, "total": cube.total, "rows": table.to_dict("records"),
+                    "ms": round(1000 * (time.perf_counter() - t0), 3)})
+
+# Start-up warm-up: cleaned data + base tables (which read the mapping tables) built in the background
+WARMUP_STEPS = ["Loading cleaned data", "Building base tables, mapping registry, filter index and summary cube"]
+_warmup = {"status": "idle", "step": None, "done": 0, "error": None, "started": None, "finished": None}
+_warmup_lock = threading.Lock()
+
+def _set_warmup(**fields) -> None:
+    with _warmup_lock:
+        _warmup.update(fields)
+
+def _warm_up() -> None:
+    try:
+        _set_warmup(step=WARMUP_STEPS[0])
+        tt_df, ct_df = load_clean_data()
+        _set_warmup(step=WARMUP_STEPS[1], done=1)
+        union = _base_frames(tt_df, ct_df)["rev"]
+        bitmap_index(union)
+        summary_cube(union)
+        _set_warmup(status="ready", step=None, done=2, finished=time.time())
+        print(f"[Warmup] Ready after {_warmup['finished'] - _warmup['started']:.1f}s")
+    except Exception as e:
+        print(f"[WARN] Warm-up failed: {type(e).__name__}: {e}\n"
+              f"       Data will be loaded by the first request.")
+        _set_warmup(status="failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+
+def _mark_ready() -> None:
+    # a request that loaded the data and base tables makes the process ready too (e.g. after a failed warm-up);
+    # a running warm-up reports readiness itself, once the filter index and summary cube are built as well
+    with _warmup_lock:
+        if _warmup["status"] in ("idle", "failed"):
+            _warmup.update(status="ready", step=None, done=len(WARMUP_STEPS), error=None, finished=time.time())
+
+def start_warmup() -> bool:
+    # idempotent; returns False if warm-up already ran, is running, or failed less than WARMUP_RETRY_SECONDS ago
+    with _warmup_lock:
+        retry = _warmup["status"] == "failed" and time.time() - _warmup["finished"] >= app.config.get("WARMUP_RETRY_SECONDS", 60)
+        if _warmup["status"] != "idle" and not retry:
+            return False
+        _warmup.update(status="warming", step=None, done=0, error=None, started=time.time(), finished=None)
+    threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+    return True
+
+def _warmup_state() -> dict:
+    with _warmup_lock:
+        state = dict(_warmup)
+    state["progress"] = int(100 * state["done"] / len(WARMUP_STEPS))
+    state["elapsed"] = round((state["finished"] or time.time()) - state["started"], 3) if state["started"] else None
+    return state
+
+@app.route("/healthz")
+def healthz():
+    # liveness: the process answers (warm-up state for information only)
+    return jsonify({"status": "ok", "warmup": _warmup_state()})
+
+@app.route("/readyz")
+def readyz():
+    # readiness: 200 once cleaned data and base tables are in memory, 503 while warming up (or after a failed warm-up)
+    # with WARMUP_ON_START, a probe starts the warm-up if none ran yet (a WSGI server never runs __main__) or retries a
+    # failed one after WARMUP_RETRY_SECONDS; without it the process is ready once a request has loaded the data
+    if app.config.get('WARMUP_ON_START', True):
+        start_warmup()
+    state = _warmup_state()
+    return jsonify({"ready": state["status"] == "ready", **state}), 200 if state["status"] == "ready" else 503
+
+@app.route("/api/memory")
+def memory():
+    # resident footprint of the cleaned frames (per column, largest first) and of the cached results;
+    # doesn't load anything, so before warm-up the frames are reported as not loaded
+    data = _clean_data   # no lock: it is only ever set once, and the lock is held for the whole load
+    frames = {}
+    for name, df in zip(("tt", "ct"), data or ()):
+        usage = df.memory_usage(index=False, deep=True).sort_values(ascending=False)
+        frames[name] = {"rows": len(df), "bytes": int(usage.sum()),
+                        "columns": [{"column": c, "dtype": Utils.dtype_name(df[c].dtype), "bytes": int(b)} for c, b in usage.items()]}
+    return jsonify({"loaded": data is not None, "frames": frames,
+                    "result_cache": results.stats()})
+
 
 # Example: use cleaned data when showing results
 # @app.route("/results")
@@ -556,6 +884,9 @@ if __name__ == "__main__":
             f"Left rows={len(Left_only_TT_CT):,}, Join rows={len(Join_TT_CT):,}"
         )
     else:
+        # serve right away; /readyz turns 200 once the background warm-up is done
+        if app.config.get('WARMUP_ON_START', True):
+            start_warmup()
         app.run(debug=True, use_reloader=False)
 
 
@@ -1,4 +1,121 @@
+import re
+import numpy as np
 import pandas as pd
+from Utils import frame_memo
+
+# Rules for the Bain_* columns (evaluated only on rows that pass the row filters)
+
+# Bain_Therapeutic Area (whitelist else 'Multiple'; vaccine variants collapse to 'Vaccines')
+TA_WHITELIST = {
+    "Oncology", "Cns", "Unassigned", "Metabolic/Endocrinology", "Autoimmune/Inflammation",
+    "Infectious Disease", "Cardiovascular", "Infectious Disease; Vaccines (Infectious Disease)",
+    "Genitourinary", "Ophthalmology", "Vaccines (Infectious Disease)"
+}
+TA_VACCINE_VARIANTS = {
+    "Infectious Disease; Vaccines (Infectious Disease)",
+    "Vaccines (Infectious Disease)"
+}
+TA_MAP = {ta: ("Vaccines" if ta in TA_VACCINE_VARIANTS else ta) for ta in TA_WHITELIST}
+
+# Bain_Covid Tag: any token in TITLE + " " + DISEASE (upper-cased)
+COVID_TOKENS = [
+    "COVID-19", "COVID", "2019-NCOV", "SARS-COV-2", "WUHAN CORONAVIRUS",
+    "NCOV-19", "NCOV-2019", "2019 NOVEL CORONAVIRUS",
+    "SEVERE ACUTE RESPIRATORY SYNDROME CORONAVIRUS 2"
+]
+
+# Bain_Phase mapping
+PHASE_MAP = {
+    "I/II": "II",
+    "II/III": "III",
+    "III/IV": "III",
+    "I": "I",
+    "II": "II",
+    "III": "III",
+    "IV": "IV",
+}
+
+# Bain_Trial Region: (North America, Western Europe, APAC) presence -> bucket; anything else is 'Other'
+REGION_RULES = [
+    ((True,  False, False), "NA only"),
+    ((False, True,  False), "EU only"),
+    ((False, False, True),  "APAC only"),
+    ((True,  True,  False), "NA and EU"),
+    ((True,  False, True),  "NA and APAC"),
+    ((False, True,  True),  "EU and APAC"),
+    ((True,  True,  True),  "Global"),
+]
+
+# Bain_Healthy Patient: any token in TITLE / STUDY KEYWORDS / STUDY DESIGN (plus no NCT code and phase I)
+HP_TOKENS = ["HEALTHY", "BIOEQUIVALENCE", "BIOAVAILABILITY"]
+
+# one compiled alternation per token set -> one scan per text
+_RX_COVID = re.compile("|".join(map(re.escape, COVID_TOKENS)))
+_RX_HP    = re.compile("|".join(HP_TOKENS))
+
+
+def _text(df: pd.DataFrame, col: str) -> pd.Series:
+    # column as plain text, nulls -> "" (categoricals from the compact schema can't be filled with a new value)
+    s = df[col]
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    return s.fillna("").astype(str)
+
+
+def _upper_text(df: pd.DataFrame, col: str) -> pd.Series:
+    return _text(df, col).str.upper()
+
+
+_NO_MONTH = 10**9   # month key of rows without a usable Start Date (sorted last, never in a window)
+
+
+def therapeutic_area(df: pd.DataFrame) -> pd.Series:
+    # Bain_Therapeutic Area rule
+    return df["Therapeutic Area"].astype(object).map(TA_MAP).fillna("Multiple")
+
+
+def trial_region(df: pd.DataFrame) -> np.ndarray:
+    # Bain_Trial Region rule
+    tr = _text(df, "Trial Region")
+    has_na   = tr.str.contains("North America", regex=False).to_numpy()
+    has_eu   = tr.str.contains("Western Europe", regex=False).to_numpy()
+    has_apac = (tr.str.contains("Asia", regex=False) | tr.str.contains("Australia/Oceania", regex=False)).to_numpy()
+    return np.select(
+        [(has_na == na) & (has_eu == eu) & (has_apac == apac) for (na, eu, apac), _ in REGION_RULES],
+        [label for _, label in REGION_RULES], default="Other")
+
+
+def _month_key(year: int, month: int) -> int:
+    return year * 12 + month - 1
+
+
+def _build_date_index(df: pd.DataFrame) -> dict:
+    # Start/Last Modified Date parsed once, plus the rows ordered by Start Date month (stable, so ties keep row order)
+    start = pd.to_datetime(df["Start Date"], errors="coerce", utc=True)
+    key = (start.dt.year * 12 + start.dt.month - 1).fillna(_NO_MONTH).to_numpy(dtype=np.int64)
+    order = np.argsort(key, kind="stable")
+    return {"start": start.array, "last_modified": pd.to_datetime(df["Last Modified Date"], errors="coerce", utc=True).array,
+            "order": order, "sorted_keys": key[order]}
+
+
+def date_index(df: pd.DataFrame) -> dict:
+    """
+    Monthly Start Date index of `df`: {"start"/"last_modified": parsed UTC dates, "order": row positions sorted by
+    month key, "sorted_keys": their keys}. Memoised per frame, so sweeping date windows over one frame parses once.
+    """
+    return frame_memo(df, "date_index", _build_date_index)
+
+
+def month_window(idx: dict, start_year: int, start_month: int, end_year: int, end_month: int) -> np.ndarray:
+    # positions (in month order) of rows with Start Date in [start month, end month): a binary search on the month index
+    lo, hi = np.searchsorted(idx["sorted_keys"], [_month_key(start_year, start_month), _month_key(end_year, end_month)])
+    return idx["order"][lo:hi]
+
+
+def window_rows(df: pd.DataFrame, start_year: int, start_month: int, end_year: int, end_month: int) -> np.ndarray:
+    # month_window over df's date index, as ascending row positions
+    return np.sort(month_window(date_index(df), start_year, start_month, end_year, end_month))
+
 
 def apply_filters(
     df: pd.DataFrame,
@@ -13,113 +130,45 @@ def apply_filters(
     Start month/year is inclusive; end month/year is exclusive.
     """
 
-    df = df.copy()
+    # 1) ROW FILTERS (before any derived column)
+    # month-aware window [start, end) from the Start Date index, then Start Date < Last Modified Date
+    idx = date_index(df)
+    rows = window_rows(df, start_year, start_month, end_year, end_month)
+    rows = rows[idx["start"][rows] < idx["last_modified"][rows]]
+    df = df.iloc[rows]
 
-    # filter out Planned
-    df = df[df["TT_Trial Status"].fillna("") != "Planned"]
+    # filter out Planned; Sponsor/Collaborator Type starts with 'Industry'
+    keep = (_text(df, "TT_Trial Status") != "Planned") & _text(df, "Sponsor/Collaborator Type").str.startswith("Industry")
+    keep = keep.to_numpy(dtype=bool)
+    rows = rows[keep]
+    df = df.iloc[keep].copy()
 
-    # coerce dates
-    df["Start Date"] = pd.to_datetime(df["Start Date"], errors="coerce", utc=True)
-    df["Last Modified Date"] = pd.to_datetime(df["Last Modified Date"], errors="coerce", utc=True)
+    # parsed dates (UTC)
+    df["Start Date"] = pd.Series(idx["start"][rows], index=df.index)
+    df["Last Modified Date"] = pd.Series(idx["last_modified"][rows], index=df.index)
 
+    # 2) DERIVED COLUMNS
     # derive start year/month columns
     df["Bain_Start Year"] = df["Start Date"].dt.year.astype("Int64")
     df["Bain_Start Month"] = df["Start Date"].dt.month.astype("Int64")
 
-    # month-aware window: [start, end)
-    start_bound = pd.Timestamp(start_year, start_month, 1, tz="UTC")
-    end_bound   = pd.Timestamp(end_year,   end_month,   1, tz="UTC")
-    df = df[(df["Start Date"] >= start_bound) & (df["Start Date"] < end_bound)]
-
-    # Bain_Therapeutic Area (whitelist else 'Multiple')
-    whitelist = {
-        "Oncology", "Cns", "Unassigned", "Metabolic/Endocrinology", "Autoimmune/Inflammation",
-        "Infectious Disease", "Cardiovascular", "Infectious Disease; Vaccines (Infectious Disease)",
-        "Genitourinary", "Ophthalmology", "Vaccines (Infectious Disease)"
-    }
-
-    df["Bain_Therapeutic Area"] = df["Therapeutic Area"].where(
-        df["Therapeutic Area"].isin(whitelist), other="Multiple"
-    )
-
-    # Collapse vaccine variants to 'Vaccines'
-    vaccine_variants = {
-        "Infectious Disease; Vaccines (Infectious Disease)",
-        "Vaccines (Infectious Disease)"
-    }
-    df.loc[df["Bain_Therapeutic Area"].isin(vaccine_variants), "Bain_Therapeutic Area"] = "Vaccines"
-
-    # Bain_Covid Tag
-    covid_tokens = [
-        "COVID-19", "COVID", "2019-NCOV", "SARS-COV-2", "WUHAN CORONAVIRUS",
-        "NCOV-19", "NCOV-2019", "2019 NOVEL CORONAVIRUS",
-        "SEVERE ACUTE RESPIRATORY SYNDROME CORONAVIRUS 2"
-    ]
-    joined_text = (
-        df["Trial Title"].fillna("").astype(str).str.upper() + " " +
-        df["Disease"].fillna("").astype(str).str.upper()
-    )
-    covid_mask = pd.Series(False, index=df.index)
-    for token in covid_tokens:
-        covid_mask = covid_mask | joined_text.str.contains(token, regex=False)
-    df["Bain_Covid Tag"] = covid_mask.map(lambda x: "Covid - Recommend Exclude" if x else "")
-
-    # Bain_Phase mapping
-    raw_phase = df["Trial Phase"].fillna("").astype(str).str.upper().str.strip()
-    phase_map = {
-        "I/II": "II",
-        "II/III": "III",
-        "III/IV": "III",
-        "I": "I",
-        "II": "II",
-        "III": "III",
-        "IV": "IV",
-    }
-    df["Bain_Phase"] = raw_phase.map(phase_map).fillna("Recommend Exclude")
-
-    # Bain_Trial Region bucketing
-    tr = df["Trial Region"].fillna("").astype(str)
-    has_na   = tr.str.contains("North America", regex=False)
-    has_eu   = tr.str.contains("Western Europe", regex=False)
-    has_asia = tr.str.contains("Asia", regex=False)
-    has_au   = tr.str.contains("Australia/Oceania", regex=False)
-    has_apac = has_asia | has_au
-
-    df["Bain_Trial Region"] = "Other"
-    df.loc[ has_na & ~has_eu & ~has_apac, "Bain_Trial Region"] = "NA only"
-    df.loc[ has_eu & ~has_na & ~has_apac, "Bain_Trial Region"] = "EU only"
-    df.loc[ has_apac & ~has_na & ~has_eu, "Bain_Trial Region"] = "APAC only"
-    df.loc[ has_na & has_eu & ~has_apac,  "Bain_Trial Region"] = "NA and EU"
-    df.loc[ has_na & has_apac & ~has_eu,  "Bain_Trial Region"] = "NA and APAC"
-    df.loc[ has_eu & has_apac & ~has_na,  "Bain_Trial Region"] = "EU and APAC"
-    df.loc[ has_na & has_eu & has_apac,   "Bain_Trial Region"] = "Global"
-
-    # Filter Start Date > Last Modified Date
-    df = df[df["Start Date"] < df["Last Modified Date"]]
-
-    # Bain_Healthy Patient
-    title_u   = df["Trial Title"].fillna("").astype(str).str.upper()
-    keywords_u= df["Study Keywords"].fillna("").astype(str).str.upper()
-    design_u  = df["TT_Study Design"].fillna("").astype(str).str.upper()
-    hp_tokens = ["HEALTHY", "BIOEQUIVALENCE", "BIOAVAILABILITY"]
-    hp_regex  = "|".join(hp_tokens)
-    is_hp_text = (
-        title_u.str.contains(hp_regex, regex=True) |
-        keywords_u.str.contains(hp_regex, regex=True) |
-        design_u.str.contains(hp_regex, regex=True)
-    )
-    df["Bain_Healthy Patient"] = (
-        (df["NCT Code"] == "No NCT Code") &
-        (df["Bain_Phase"] == "I") &
-        is_hp_text
-    ).map(lambda x: "Yes" if x else "No")
-
-    # Filter Sponsor/Collaborator Type starts with 'Industry'
-    sct = df["Sponsor/Collaborator Type"].fillna("").astype(str)
-    df = df[sct.str.startswith("Industry")]
+    df["Bain_Therapeutic Area"] = therapeutic_area(df)
+
+    title_u = _upper_text(df, "Trial Title")
+    covid = (title_u + " " + _upper_text(df, "Disease")).str.contains(_RX_COVID)
+    df["Bain_Covid Tag"] = np.where(covid, "Covid - Recommend Exclude", "")
+
+    df["Bain_Phase"] = _text(df, "Trial Phase").str.upper().str.strip().map(PHASE_MAP).fillna("Recommend Exclude")
+
+    df["Bain_Trial Region"] = trial_region(df)
+
+    # "\n" never occurs in a token, so one scan over the joined texts equals three separate scans
+    hp_text = title_u.str.cat([_upper_text(df, "Study Keywords"), _upper_text(df, "TT_Study Design")], sep="\n")
+    is_hp = (df["NCT Code"] == "No NCT Code") & (df["Bain_Phase"] == "I") & hp_text.str.contains(_RX_HP)
+    df["Bain_Healthy Patient"] = np.where(is_hp, "Yes", "No")
 
     return df
 
 # input = pd.read_csv("database/temp.csv", encoding='latin1')
 # output = process_trials_df(input, start_year=2023, start_month=1, end_year=2024, end_month=1)
-# output.to_csv("database/processed_temp.csv", index=False)
\ No newline at end of file
+# output.to_csv("database/processed_temp.csv", index=False)